@@ -0,0 +1,328 @@
+"""
+Analysis of many tracks at once, as done by TrackAnalyser for a single one
+
+The fixes of all the tracks are concatenated in one array, track k owning
+the rows offsets[k] .. offsets[k + 1] - 1, so that the features and glide
+masks of all the tracks are computed by single vectorized calls. The steps
+(from one fix to the next) are concatenated the same way, a track of n
+fixes having n - 1 steps, and the sweeping windows never cross a track
+boundary. The sums over a track are differences of sums over the whole
+batch, so the features match the ones of TrackAnalyser up to their
+rounding.
+
+Step 1 still analyses the flights one by one, the batch being only timed
+by bench.py for now.
+"""
+
+import numpy as np
+
+from . import geodesy
+from .igc_analyser import (
+    MAX_TIME_DELTA,
+    MIN_ALTITUDE_RANGE,
+    MIN_TIME_DELTA,
+    SEGMENT_DTYPE,
+    TrackAnalyser,
+    glide_mask,
+    mask_runs,
+)
+from .igc_reader import IGCReader
+from .windows import Windows, prefix_sums
+
+# glide segments of a batch, track being the index of their track
+BATCH_SEGMENT_DTYPE = np.dtype([("track", "<i8")] + SEGMENT_DTYPE.descr)
+
+# sanity code of the tracks that could not be read
+UNREADABLE = -1
+
+
+class BatchTrackAnalyser:
+    def __init__(
+        self,
+        fixes,
+        offsets,
+        days=None,
+        frame_len_sec=20,
+        max_turn=10,
+        min_speed=25,
+        min_sec=20,
+        max_glide_ratio=15,
+        min_glide_ratio=2,
+        geodesy_mode=geodesy.HAVERSINE,
+    ):
+        """
+        fixes are the concatenated IGCReader.data_formated of the tracks
+        the equirectangular projection of geodesy_mode is taken at the mean
+        latitude of every track
+        """
+        self.frame_len_sec = frame_len_sec
+        self.max_turn = max_turn
+        self.min_speed = min_speed
+        self.min_sec = min_sec
+        self.max_glide_ratio = max_glide_ratio
+        self.min_glide_ratio = min_glide_ratio
+        self.geodesy_mode = geodesy_mode
+        self.fixes = fixes
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.days = days
+        self.unreadable = np.zeros(len(self), dtype=bool)
+
+        nb_fixes = np.diff(self.offsets)
+        nb_steps = np.maximum(nb_fixes - 1, 0)
+        self.step_offsets = np.concatenate(([0], np.cumsum(nb_steps)))
+        # track, index within the track and first fix of every step
+        self.step_track = np.repeat(np.arange(len(self)), nb_steps)
+        self.step_local = np.arange(self.step_offsets[-1]) - np.repeat(
+            self.step_offsets[:-1], nb_steps
+        )
+        self.step_fix = self.offsets[self.step_track] + self.step_local
+
+        # nan for the tracks without any step
+        ts = self.fixes[:, 0]
+        has_steps = nb_steps > 0
+        self.track_mean_time_delta = np.full(len(self), np.nan)
+        self.track_mean_time_delta[has_steps] = (
+            ts[self.offsets[1:][has_steps] - 1] - ts[self.offsets[:-1][has_steps]]
+        ) / nb_steps[has_steps]
+
+    @classmethod
+    def from_files(cls, filenames, use_cache=False, **params):
+        """
+        the tracks which can't be read are left empty, with the UNREADABLE
+        sanity code
+        """
+        tracks = []
+        days = []
+        unreadable = []
+        for filename in filenames:
+            try:
+                track = IGCReader(filename, use_cache=use_cache)
+                tracks.append(track.data_formated)
+                days.append(track.day)
+                unreadable.append(False)
+            except (OSError, ValueError):
+                tracks.append(np.zeros((0, 5)))
+                days.append(None)
+                unreadable.append(True)
+        offsets = np.concatenate(([0], np.cumsum([t.shape[0] for t in tracks])))
+        fixes = np.concatenate(tracks) if len(tracks) > 0 else np.zeros((0, 5))
+        batch = cls(fixes, offsets.astype(np.int64), days, **params)
+        batch.unreadable = np.array(unreadable, dtype=bool)
+        return batch
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def _track_range(self, values):
+        """
+        returns the per track max - min of the values of the fixes,
+        0 for the empty tracks
+        """
+        value_range = np.zeros(len(self))
+        non_empty = self.offsets[1:] > self.offsets[:-1]
+        if np.any(non_empty):
+            # the empty tracks have no fix between two non empty ones
+            starts = self.offsets[:-1][non_empty]
+            value_range[non_empty] = np.maximum.reduceat(
+                values, starts
+            ) - np.minimum.reduceat(values, starts)
+        return value_range
+
+    def check_track_sanity(self, use_baro=True):
+        """
+        returns the TrackAnalyser.check_track_sanity codes of all the tracks
+        """
+        altitude = self.fixes[:, 4] if use_baro else self.fixes[:, 3]
+        time_delta = self.track_mean_time_delta
+        step_dt = self.fixes[self.step_fix + 1, 0] - self.fixes[self.step_fix, 0]
+        has_negative = (
+            np.bincount(self.step_track, step_dt < 0, len(self)).astype(int) > 0
+        )
+
+        sanity = np.zeros(len(self), dtype=int)
+        sanity[self._track_range(altitude) < MIN_ALTITUDE_RANGE] = 3
+        sanity[has_negative] = 2
+        bad_delta = (
+            (time_delta > MAX_TIME_DELTA)
+            | (time_delta < MIN_TIME_DELTA)
+            | np.isnan(time_delta)
+        )
+        sanity[bad_delta] = 1
+        sanity[self.unreadable] = UNREADABLE
+        return sanity
+
+    def select_altitude_source(self):
+        """
+        returns the per track use_baro and sanity code, as
+        TrackAnalyser.select_altitude_source
+        """
+        sanity_baro = self.check_track_sanity(use_baro=True)
+        use_baro = sanity_baro == 0
+        sanity = np.where(use_baro, 0, self.check_track_sanity(use_baro=False))
+        return use_baro, sanity
+
+    def process(self, use_baro=None):
+        """
+        use_baro is given per track, all the tracks use the baro if None
+        """
+        if use_baro is None:
+            use_baro = np.ones(len(self), dtype=bool)
+        track = self.step_track
+        start = self.step_fix
+
+        ts = self.fixes[:, 0]
+        lat = self.fixes[:, 1]
+        lon = self.fixes[:, 2]
+        nb_fixes = np.diff(self.offsets)
+        fix_track = np.repeat(np.arange(len(self)), nb_fixes)
+        altitude = np.where(use_baro[fix_track], self.fixes[:, 4], self.fixes[:, 3])
+
+        ref_lat, fix_ref_lat = None, None
+        if self.geodesy_mode == geodesy.EQUIRECTANGULAR:
+            track_lat = np.bincount(fix_track, lat, len(self)) / np.maximum(nb_fixes, 1)
+            ref_lat = track_lat[track]
+            fix_ref_lat = track_lat[fix_track[:-1]]
+        ver_dist = altitude[start + 1] - altitude[start]
+        # from every fix to the next, then only the steps within a track
+        hor_dist, heading = geodesy.distance_and_bearing(
+            lat[:-1], lon[:-1], lat[1:], lon[1:], self.geodesy_mode, fix_ref_lat
+        )
+        hor_dist, heading = hor_dist[start], heading[start]
+        safe_hor_dist = np.where(hor_dist == 0, 0.0000001, hor_dist)
+
+        # the first step of a track turns from a heading of 0
+        previous_heading = np.concatenate(([0], heading[:-1]))
+        previous_heading[self.step_local == 0] = 0
+        turn = heading - previous_heading
+        turn = (turn + 180) % 360 - 180
+        glide_angle = np.arctan(ver_dist / safe_hor_dist) / np.pi * 180
+
+        # the window ending at a step covers the fixes lo .. end of its track
+        windows = Windows.trailing(
+            ts[start], ts[start + 1], self.frame_len_sec, self.step_offsets
+        )
+        lo = self.step_fix[windows.lo]
+        end = self.step_fix[windows.hi - 1] + 1
+        with np.errstate(divide="ignore", invalid="ignore"):
+            window_duration = ts[end] - ts[lo]
+            self.glide_angles = windows.mean(glide_angle)
+            self.turn_speeds = windows.sum(turn) / window_duration
+            self.straight_line_speeds = (
+                geodesy.distance(
+                    lat[end],
+                    lon[end],
+                    lat[lo],
+                    lon[lo],
+                    self.geodesy_mode,
+                    ref_lat,
+                )
+                / window_duration
+            )
+
+        self.heading = heading
+        self.glide_angles_instantaneous = glide_angle
+        self.turn_speeds_instantaneous = turn
+        self.timestamps = ts[start + 1] - ts[self.offsets[track]]
+        self.cumulative_distance = prefix_sums(hor_dist, self.step_offsets)
+        self.use_baro = use_baro
+
+    def calc_glide_mask(self, sane=None):
+        """
+        only the tracks whose sane is True are searched for glides,
+        all of them if None
+        """
+        nb_tracks = len(self)
+        min_iter = np.round(self.min_sec / self.track_mean_time_delta)
+        min_iter = np.nan_to_num(min_iter, nan=0).astype(np.int64)
+
+        mask = glide_mask(
+            self.turn_speeds,
+            self.straight_line_speeds,
+            self.glide_angles,
+            self.max_turn,
+            self.min_speed,
+            self.max_glide_ratio,
+            self.min_glide_ratio,
+        )
+        if sane is not None:
+            mask *= sane[self.step_track]
+
+        # the tracks are separated by a 0 so that runs never span two tracks
+        padded = np.zeros(mask.shape[0] + nb_tracks, dtype=int)
+        padded[np.arange(mask.shape[0]) + self.step_track] = mask
+        starts, ends = mask_runs(padded)
+        padded_offsets = self.step_offsets + np.arange(nb_tracks + 1)
+        track = np.searchsorted(padded_offsets, starts, side="right") - 1
+        starts -= track
+        ends -= track
+        keep = ends - starts > min_iter[track]
+        track, starts, ends = track[keep], starts[keep], ends[keep]
+
+        edges = np.zeros(mask.shape[0] + 1, dtype=int)
+        np.add.at(edges, starts, 1)
+        np.add.at(edges, ends, -1)
+        self._unfiltered_glide_mask = mask
+        self.glide_mask = np.cumsum(edges[:-1])
+        self.glide_segments = self._segment_table(track, starts, ends)
+
+    def _segment_table(self, track, starts, ends):
+        """
+        starts and ends are global step indexes, the table holding the
+        indexes within the tracks as TrackAnalyser.glide_segments
+        """
+        ts = self.fixes[:, 0]
+        step_base = self.step_offsets[track]
+        fix_base = self.offsets[track]
+        cum_glide_angle = prefix_sums(self.glide_angles, self.step_offsets)
+        cum_starts = starts + track
+        cum_ends = ends + track
+        segments = np.zeros(starts.shape[0], dtype=BATCH_SEGMENT_DTYPE)
+        segments["track"] = track
+        segments["start_index"] = starts - step_base
+        segments["end_index"] = ends - step_base
+        segments["start"] = ts[fix_base + starts - step_base] - ts[fix_base]
+        segments["end"] = ts[fix_base + ends - step_base] - ts[fix_base]
+        segments["duration"] = segments["end"] - segments["start"]
+        segments["glide_angle_mean"] = (
+            cum_glide_angle[cum_ends] - cum_glide_angle[cum_starts]
+        ) / (ends - starts)
+        segments["distance"] = (
+            self.cumulative_distance[cum_ends] - self.cumulative_distance[cum_starts]
+        )
+        return segments
+
+    def get_glide_sums(self):
+        """
+        returns the per track number, sum and sum of squares of the sweeping
+        mean glide angles of the steps within a glide
+        """
+        in_glide = self.glide_mask == 1
+        track = self.step_track[in_glide]
+        glide_angles = self.glide_angles[in_glide]
+        return (
+            np.bincount(track, minlength=len(self)),
+            np.bincount(track, glide_angles, len(self)),
+            np.bincount(track, glide_angles**2, len(self)),
+        )
+
+    def get_glide_samples(self, track):
+        """
+        returns the sweeping mean glide angles of the steps within a glide
+        of a track, as TrackAnalyser.get_glide_samples
+        """
+        steps = slice(self.step_offsets[track], self.step_offsets[track + 1])
+        return self.glide_angles[steps][self.glide_mask[steps] == 1]
+
+
+def analyse_files(filenames, use_cache=False, **params):
+    """
+    returns the batch of the igc files, processed with the same altitude
+    source choice and sanity rejection as step 1, and their sanity codes
+    """
+    batch = BatchTrackAnalyser.from_files(
+        filenames, use_cache, **TrackAnalyser.resolve_params(**params)
+    )
+    use_baro, sanity = batch.select_altitude_source()
+    batch.process(use_baro=use_baro)
+    batch.calc_glide_mask(sane=sanity == 0)
+    return batch, sanity
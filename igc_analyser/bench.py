@@ -0,0 +1,460 @@
+"""
+Benchmarks the analysis pipeline on synthetic flights and checks that its
+results do not change
+
+Every stage (parse, process, mask) is timed on single tracks of several
+sizes, the geodesy modes, the analysis of short tracks one by one against
+a batch, the transfer of arrays from the worker processes, the reading of
+tracks from an archive, then steps 1 (analyse) and 2 (aggregate) on work
+directories of several sizes. The results are checked against the line by
+line igc reader and the streaming analyser, and against a reference file
+if given.
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing as mp
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+
+from . import geodesy, utils
+from .batch import BatchTrackAnalyser
+from .flight_index import FlightIndex
+from .glide.step1 import main as step1_main
+from .glide.step2 import main as step2_main
+from .igc_analyser import TrackAnalyser, planar_heading
+from .igc_archive import IGCArchive
+from .igc_reader import IGCReader
+from .shared_arrays import share_array, start_sharing, take_shared_array
+from .streaming import stream_glide_segments
+from .synthetic import generate_fixes, make_workdir, write_igc
+
+
+def best_time(func, repeat):
+    """
+    returns the result of func and its best execution time over repeat runs
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def analyse(path):
+    t = TrackAnalyser(path)
+    use_baro, _ = t.select_altitude_source()
+    t.process(use_baro=use_baro)
+    t.calc_glide_mask()
+    return t, use_baro
+
+
+def check_track(path):
+    """
+    returns the list of the checks failed by the analysis of a track
+    """
+    failures = []
+    bulk = IGCReader(path)
+    lines = IGCReader(path, bulk=False)
+    if bulk.day != lines.day or not np.array_equal(
+        bulk.data_formated, lines.data_formated
+    ):
+        failures.append("bulk and line by line parsings differ")
+
+    t, use_baro = analyse(path)
+    params = TrackAnalyser.resolve_params(**vars(t))
+    segments = list(
+        stream_glide_segments(
+            path,
+            chunk_size=1 << 16,
+            time_delta=t.track_mean_time_delta,
+            use_baro=use_baro,
+            **params,
+        )
+    )
+    nb_samples = t.glide_segments["end_index"] - t.glide_segments["start_index"]
+    if [s.nb_samples for s in segments] != list(nb_samples) or not np.allclose(
+        [s.glide_angle_mean for s in segments],
+        t.glide_segments["glide_angle_mean"],
+    ):
+        failures.append("streaming and batch glide segments differ")
+    return failures
+
+
+def bench_tracks(tmpdir, durations, repeat):
+    results = {}
+    failures = []
+    for duration in durations:
+        path = os.path.join(tmpdir, f"track_{duration}.igc")
+        write_igc(path, duration=duration)
+        track, parse_time = best_time(lambda: TrackAnalyser(path), repeat)
+        _, process_time = best_time(track.process, repeat)
+        _, mask_time = best_time(track.calc_glide_mask, repeat)
+        nb_fixes = track.track.data_formated.shape[0]
+        print(
+            f"{nb_fixes:>9} fixes | "
+            + " | ".join(
+                f"{name} {nb_fixes / elapsed:>12,.0f} fixes/s"
+                for name, elapsed in (
+                    ("parse", parse_time),
+                    ("process", process_time),
+                    ("mask", mask_time),
+                )
+            )
+        )
+        for failure in check_track(path):
+            print(f"    FAILED: {failure}")
+            failures.append(failure)
+        samples = track.get_glide_samples()
+        results[str(duration)] = {
+            "nb_glide_samples": int(samples.shape[0]),
+            "glide_angle_mean": float(np.mean(samples)),
+        }
+    return results, failures
+
+
+def angle_error(a, b):
+    return np.abs((a - b + 180) % 360 - 180)
+
+
+def bench_geodesy(duration, repeat, window=20):
+    """
+    times the distances and bearings of the steps of a synthetic track in
+    every geodesy mode, and measures their errors against the ellipsoid on
+    the steps and on the windows of the straight line speeds
+    returns the failures of the check of vincenty against a published case
+    """
+    fixes = generate_fixes(duration=duration)
+    lat, lon = fixes[:, 1], fixes[:, 2]
+    steps = (lat[:-1], lon[:-1], lat[1:], lon[1:])
+    windows = (lat[:-window], lon[:-window], lat[window:], lon[window:])
+    ref_dist, ref_bearing = geodesy.vincenty(*steps)
+    ref_window = geodesy.vincenty(*windows)[0]
+    moving = ref_dist > 1
+
+    def report(name, elapsed, dist, bearing, window_dist):
+        print(
+            f"{name:>15} | {lat.shape[0] / elapsed:>12,.0f} steps/s | "
+            f"distance {np.max(np.abs(dist / ref_dist - 1)[moving]):.1e} | "
+            f"window {np.max(np.abs(window_dist / ref_window - 1)):.1e} | "
+            f"bearing {np.max(angle_error(bearing, ref_bearing)[moving]):.1e} deg"
+        )
+
+    (dist, bearing), elapsed = best_time(
+        lambda: (geodesy.haversine(*steps), planar_heading(lat, lon)), repeat
+    )
+    report("historical", elapsed, dist, bearing, geodesy.haversine(*windows))
+    for mode in geodesy.MODES:
+        ref_lat = np.mean(lat)
+        (dist, bearing), elapsed = best_time(
+            lambda: geodesy.distance_and_bearing(*steps, mode, ref_lat), repeat
+        )
+        report(mode, elapsed, dist, bearing, geodesy.distance(*windows, mode, ref_lat))
+
+    # Flinders Peak to Buninyong, from Vincenty's paper
+    dist, bearing = geodesy.vincenty(
+        -(37 + 57 / 60 + 3.72030 / 3600),
+        144 + 25 / 60 + 29.52440 / 3600,
+        -(37 + 39 / 60 + 10.15610 / 3600),
+        143 + 55 / 60 + 35.38390 / 3600,
+    )
+    if (
+        abs(dist - 54972.271) > 1e-3
+        or angle_error(bearing, 306 + 52 / 60 + 5.37 / 3600) > 1e-5
+    ):
+        return ["vincenty differs from the published case"]
+    return []
+
+
+def bench_batch(tmpdir, nb_tracks, duration, repeat):
+    """
+    times the analysis of many short tracks as one batch against one track
+    at a time, and returns the failures of their comparison, the features
+    being compared up to the rounding of the sums
+    """
+    paths = []
+    for i in range(nb_tracks):
+        paths.append(os.path.join(tmpdir, f"short_{i}.igc"))
+        write_igc(paths[-1], duration=duration + i, seed=i)
+    tracks = [TrackAnalyser(path) for path in paths]
+    fixes = [t.track.data_formated for t in tracks]
+    offsets = np.concatenate(([0], np.cumsum([f.shape[0] for f in fixes])))
+
+    def one_by_one():
+        for t in tracks:
+            use_baro, sanity = t.select_altitude_source()
+            if sanity == 0:
+                t.process(use_baro=use_baro)
+                t.calc_glide_mask()
+
+    def batched():
+        batch = BatchTrackAnalyser(np.concatenate(fixes), offsets)
+        use_baro, sanity = batch.select_altitude_source()
+        batch.process(use_baro=use_baro)
+        batch.calc_glide_mask(sane=sanity == 0)
+        return batch
+
+    _, single_time = best_time(one_by_one, repeat)
+    batch, batch_time = best_time(batched, repeat)
+    print(
+        f"{nb_tracks:>9} tracks | "
+        f"one by one {nb_tracks / single_time:>10,.0f} tracks/s | "
+        f"batch {nb_tracks / batch_time:>10,.0f} tracks/s"
+    )
+    failures = set()
+    nb_steps, nb_differing = 0, 0
+    for k, t in enumerate(tracks):
+        if not hasattr(t, "glide_mask"):
+            # rejected track
+            continue
+        steps = slice(batch.step_offsets[k], batch.step_offsets[k + 1])
+        for name in ("glide_angles", "turn_speeds", "straight_line_speeds"):
+            if not np.allclose(
+                getattr(batch, name)[steps],
+                getattr(t, name),
+                rtol=1e-9,
+                atol=1e-9,
+                equal_nan=True,
+            ):
+                failures.add(f"batch and single track {name} differ")
+        nb_steps += t.glide_mask.shape[0]
+        nb_differing += np.sum(batch.glide_mask[steps] != t.glide_mask)
+    # the sums of the batch round differently, which only flips the steps
+    # whose features are right at a threshold
+    print(f"{' ' * 16}{nb_differing} of {nb_steps} glide mask steps differ")
+    if nb_differing > nb_steps * 1e-3:
+        failures.add("batch and single track glide masks differ")
+    return sorted(failures)
+
+
+def make_array(i, nbytes, min_bytes):
+    """
+    returns the share_array of an array of nbytes from a worker process
+    """
+    return share_array(np.full(nbytes // 4, i, dtype=np.float32), min_bytes)
+
+
+def bench_transfer(sizes, repeat, count=200):
+    """
+    times the transfer of arrays of several sizes from a worker process,
+    pickled through the pool pipe against through shared memory, and
+    returns the failures of their comparison
+    """
+    failures = []
+    start_sharing()
+    with mp.Pool(1) as p:
+        for nbytes in sizes:
+
+            def transfer(min_bytes):
+                make = functools.partial(make_array, nbytes=nbytes, min_bytes=min_bytes)
+                return [take_shared_array(ref) for ref in p.imap(make, range(count))]
+
+            # a larger array than any other is always pickled
+            pickled, pickle_time = best_time(lambda: transfer(nbytes + 1), repeat)
+            shared, shared_time = best_time(lambda: transfer(0), repeat)
+            print(
+                f"{nbytes / 1e3:>9,.0f} KB | "
+                f"pickled {pickle_time / count * 1e3:>8.3f} ms | "
+                f"shared memory {shared_time / count * 1e3:>8.3f} ms"
+            )
+            if not all(np.array_equal(a, b) for a, b in zip(pickled, shared)):
+                failures.append("shared and pickled arrays differ")
+    return failures
+
+
+def bench_archive(tmpdir, nb_tracks, duration, repeat):
+    """
+    times the reading of tracks from their igc files against an archive,
+    the files being in the page cache, and returns the failures of their
+    comparison
+    """
+    track_dir = os.path.join(tmpdir, "archive")
+    os.makedirs(track_dir)
+    archive = IGCArchive(os.path.join(tmpdir, "archive.igcz"))
+    names = []
+    for i in range(nb_tracks):
+        names.append(f"track_{i}.igc")
+        path = os.path.join(track_dir, names[-1])
+        write_igc(path, duration=duration, seed=i)
+        with open(path, "rb") as f:
+            archive.add(names[-1], f.read())
+    plain_size = sum(os.path.getsize(os.path.join(track_dir, n)) for n in names)
+    archive_size = os.path.getsize(archive.path) + os.path.getsize(archive.index_path)
+
+    def read(track_dir):
+        return [IGCReader(os.path.join(track_dir, n)).data_formated for n in names]
+
+    plain, plain_time = best_time(lambda: read(track_dir), repeat)
+    archived, archive_time = best_time(lambda: read(archive.path), repeat)
+    archive.close()
+    print(
+        f"{nb_tracks:>9} tracks | "
+        f"files {plain_size / 1e6:>6.1f} MB "
+        f"{nb_tracks / plain_time:>8,.0f} tracks/s | "
+        f"archive {archive_size / 1e6:>6.1f} MB "
+        f"{nb_tracks / archive_time:>8,.0f} tracks/s"
+    )
+    for a, b in zip(plain, archived):
+        if not np.array_equal(a, b):
+            return ["archived and plain tracks differ"]
+    return []
+
+
+def bench_corpus(tmpdir, nb_flights, njobs):
+    workdir = os.path.join(tmpdir, f"corpus_{nb_flights}")
+    make_workdir(workdir, nb_flights)
+    start = time.perf_counter()
+    with FlightIndex(utils.get_flight_index_file(workdir)) as index:
+        step1_main(
+            os.path.join(workdir, "igcfiles"),
+            index,
+            utils.get_glide_store_dir(workdir),
+            utils.get_manifest_file(workdir),
+            njobs,
+            use_cache=False,
+        )
+    step1_time = time.perf_counter() - start
+    start = time.perf_counter()
+    step2_main(workdir)
+    step2_time = time.perf_counter() - start
+    print(
+        f"{nb_flights:>9} flights | "
+        f"step1 {nb_flights / step1_time:>10,.1f} flights/s | "
+        f"step2 {nb_flights / step2_time:>10,.1f} flights/s"
+    )
+    with open(utils.get_stat_file(workdir), "rb") as f:
+        wings_perf = pickle.load(f)
+    return {
+        str(wing_id): {
+            "mean": float(perf["mean"]),
+            "nb_sample": perf["nb_sample"],
+        }
+        for wing_id, perf in wings_perf.items()
+    }
+
+
+def compare(results, reference, path=""):
+    """
+    returns the list of the values of results differing from the reference
+    """
+    if isinstance(reference, dict):
+        if not isinstance(results, dict) or set(results) != set(reference):
+            return [path]
+        return [
+            diff
+            for key in reference
+            for diff in compare(results[key], reference[key], f"{path}/{key}")
+        ]
+    if not np.isclose(results, reference, rtol=1e-9, atol=0):
+        return [path]
+    return []
+
+
+def main(durations, corpus_sizes, njobs=None, repeat=3, reference=None, save=False):
+    """
+    returns False if any check failed
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print("Single tracks")
+        results["tracks"], failures = bench_tracks(tmpdir, durations, repeat)
+        print("Geodesy, max relative errors against the ellipsoid")
+        geodesy_failures = bench_geodesy(max(durations), repeat)
+        for failure in geodesy_failures:
+            print(f"    FAILED: {failure}")
+        failures += geodesy_failures
+        print("Short tracks")
+        batch_failures = bench_batch(tmpdir, 500, 120, repeat)
+        for failure in batch_failures:
+            print(f"    FAILED: {failure}")
+        failures += batch_failures
+        print("Arrays sent back by a worker")
+        transfer_failures = bench_transfer((16_000, 256_000, 1_000_000), repeat)
+        for failure in transfer_failures:
+            print(f"    FAILED: {failure}")
+        failures += transfer_failures
+        print("Archived tracks")
+        archive_failures = bench_archive(tmpdir, 100, max(durations), repeat)
+        for failure in archive_failures:
+            print(f"    FAILED: {failure}")
+        failures += archive_failures
+        print("Work directories")
+        results["corpus"] = {
+            str(nb_flights): bench_corpus(tmpdir, nb_flights, njobs)
+            for nb_flights in corpus_sizes
+        }
+
+    if reference is not None and save:
+        with open(reference, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Reference saved to {reference}")
+    elif reference is not None:
+        with open(reference, "r") as f:
+            diffs = compare(results, json.load(f))
+        for diff in diffs:
+            print(f"FAILED: {diff} differs from the reference")
+        failures += diffs
+        if len(diffs) == 0:
+            print("Results identical to the reference")
+    return len(failures) == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--durations",
+        type=int,
+        nargs="+",
+        default=[900, 3600, 14400, 57600],
+        help="Durations in seconds of the single tracks, sampled every second",
+    )
+    parser.add_argument(
+        "--flights",
+        type=int,
+        nargs="+",
+        default=[20, 100],
+        help="Numbers of flights of the work directories",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Parallel jobs number of step 1. Default: Number of cores",
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of runs of each single track stage, the best one is kept",
+    )
+    parser.add_argument(
+        "--reference",
+        type=str,
+        default=None,
+        help="Json file of reference results to check the results against",
+    )
+    parser.add_argument(
+        "--save-reference",
+        action="store_true",
+        help="Save the results as the new reference instead of checking them",
+    )
+    args = parser.parse_args()
+
+    ok = main(
+        args.durations,
+        args.flights,
+        args.jobs,
+        args.repeat,
+        args.reference,
+        args.save_reference,
+    )
+    exit(0 if ok else 1)
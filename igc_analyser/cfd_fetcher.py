@@ -8,82 +8,302 @@ from bs4 import BeautifulSoup
 
 urllib3.disable_warnings()
 import argparse
+import asyncio
 import concurrent.futures
 import datetime as dt
 import json
+import operator
 import os
 import pickle
+import random
 import re
+import sqlite3
 import sys
+import threading
 import time
 import traceback
+import urllib.parse
 
 from progress.bar import Bar
+from requests.adapters import HTTPAdapter
 
 from . import utils
+from .flight_index import FlightIndex
+from .igc_archive import ARCHIVE_SUFFIX, open_archive
+from .timings import Timings
+
+
+def parse_wing_page(html):
+    """
+    returns the name and the class of a wing page, "Unknown" and "O"
+    if they are missing
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    try:
+        name = re.compile(r"avec une (.*) | Parapente").findall(
+            soup.find("title").text
+        )[0]
+    except (IndexError, AttributeError):
+        name = "Unknown"
+    try:
+        clas = soup.tbody.find("tr").findAll("td")[9].a.font.text
+    except (AttributeError, IndexError):
+        clas = "O"
+    # fix for wid 1294
+    if clas == "bj":
+        clas = "bi"
+    return name, clas
 
 
 class WingDetails:
-    def __init__(self):
+    """
+    name and class of the wings, cached in a SQLite database shared by all
+    the work directories
+    every wing is saved as soon as it is fetched, and the cache can be used
+    from several threads and processes at once
+    the wings whose name is unknown are fetched again after negative_ttl
+    seconds, the other ones after ttl seconds
+    """
+
+    def __init__(self, client=None, ttl=180 * 86400, negative_ttl=86400):
         self.cache_dir = "./cache"
-        self.cache_filename = "wing_details.dat"
+        self.cache_filename = "wing_details.sqlite"
         self.cachefile = os.path.join(self.cache_dir, self.cache_filename)
-        self.cache = {}
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.client = client
+        self._own_client = False
         if not os.path.isdir(self.cache_dir):
             os.makedirs(self.cache_dir)
-
-    def load_cache(self):
-        if os.path.isfile(self.cachefile):
-            with open(self.cachefile, "rb") as f:
-                self.cache = pickle.load(f)
-
-    def write_cache(self):
-        with open(self.cachefile, "wb") as f:
-            pickle.dump(self.cache, f)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.cachefile, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS wings (
+                wing_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                class TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """)
+        self.conn.commit()
+        self._import_pickle(os.path.join(self.cache_dir, "wing_details.dat"))
+
+    def _import_pickle(self, path):
+        """
+        imports the cache of the former versions, kept in a pickled dict
+        """
+        if not os.path.isfile(path):
+            return
+        with open(path, "rb") as f:
+            cache = pickle.load(f)
+        for wing_id, (name, clas) in cache.items():
+            self._store(wing_id, name, clas, replace=False)
+        os.replace(path, f"{path}.imported")
+
+    def _store(self, wing_id, name, clas, replace=True):
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO wings "
+                "VALUES (?, ?, ?, ?)",
+                (int(wing_id), name, clas, time.time()),
+            )
+
+    def get_cached(self, wing_id):
+        """
+        returns the name and class of a wing, or None if they are not
+        cached or outdated
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT name, class, fetched_at FROM wings WHERE wing_id = ?",
+                (int(wing_id),),
+            ).fetchone()
+        if row is None:
+            return None
+        name, clas, fetched_at = row
+        ttl = self.negative_ttl if name == "Unknown" else self.ttl
+        if time.time() - fetched_at > ttl:
+            return None
+        return name, clas
+
+    def _get_client(self):
+        if self.client is None:
+            self.client = CFDClient()
+            self._own_client = True
+        return self.client
 
     def get_wing_details(self, wing_id):
-        wing_id = int(wing_id)
-        if wing_id not in self.cache:
-            html = requests.get(
-                "https://parapente.ffvl.fr/cfd/liste/aile/" + str(wing_id)
-            ).text
-            soup = BeautifulSoup(html, "html.parser")
-            try:
-                name = re.compile(r"avec une (.*) | Parapente").findall(
-                    soup.find("title").text
-                )[0]
-            except IndexError:
-                name = "Unknown"
+        details = self.get_cached(wing_id)
+        if details is None:
+            html = self._get_client().get_text(f"/cfd/liste/aile/{int(wing_id)}")
+            details = parse_wing_page(html)
+            self._store(wing_id, *details)
+        return details
+
+    def prefetch(self, wing_ids):
+        """
+        fetches concurrently the wings missing from the cache
+        """
+        missing = [wid for wid in set(wing_ids) if self.get_cached(wid) is None]
+        if len(missing) == 0:
+            return
+        print(f"Fetching the details of {len(missing)} wings")
+        asyncio.run(self._fetch_wings(missing))
+
+    async def _fetch_wings(self, wing_ids):
+        client = self._get_client()
+
+        async def fetch(wing_id):
+            url = f"/cfd/liste/aile/{int(wing_id)}"
             try:
-                clas = soup.tbody.find("tr").findAll("td")[9].a.font.text
-            except AttributeError:
-                clas = "O"
-            # fix for wid 1294
-            if clas == "bj":
-                clas = "bi"
-            self.cache[wing_id] = (name, clas)
-        return self.cache[wing_id]
-
-
-def get_ffvl_no_dns(url):
-    return requests.get(
-        f"https://54.36.26.32/{url}",
-        headers={"Host": "parapente.ffvl.fr"},
+                html = await with_retries(
+                    lambda: client.fetch_text(url),
+                    f"wing {wing_id}",
+                    timings=client.timings,
+                )
+            except requests.RequestException as e:
+                # left out of the cache, fetched again when needed
+                print(f"Failed to pull wing {wing_id}: {e}")
+                return
+            self._store(wing_id, *await client.run(parse_wing_page, html))
+
+        await asyncio.gather(*(fetch(wid) for wid in wing_ids))
+
+    def close(self):
+        self.conn.close()
+        if self._own_client:
+            self.client.close()
+
+
+class CFDClient:
+    """
+    HTTP client to the CFD, whose blocking requests are run in a thread pool
+    so that they can be awaited from asyncio
+    all the requests share a pool of keep-alive connections, and the number
+    of requests in flight to each host is bounded
+    the durations of the requests are recorded in timings
+    by default the server is reached by its IP, bypassing the DNS
+    """
+
+    def __init__(
+        self,
+        base_url="https://54.36.26.32",
+        host="parapente.ffvl.fr",
+        max_connections=15,
+        max_per_host=15,
         verify=False,
-    )
-
-
-def get_all_flights_in_page(page):
-    url = f"https://parapente.ffvl.fr/cfd/liste?page={page}&sort=desc&order=date"
-    html = requests.get(url).text
-    with open("test.hml", "w") as f:
-        f.write(html)
-    soup = BeautifulSoup(html, "html.parser")
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.host = host
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.verify = verify
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_connections, pool_maxsize=max_connections
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_connections)
+        self._host_semaphores = {}
+        self.timings = Timings()
+
+    def get(self, url, **kwargs):
+        headers = {"Host": self.host} if self.host is not None else {}
+        return self.session.get(
+            f"{self.base_url}{url}", headers=headers, verify=self.verify, **kwargs
+        )
+
+    def _raise_for_status(self, r):
+        if r.status_code >= 400:
+            self.timings.count(f"http {r.status_code}")
+        r.raise_for_status()
+
+    def get_text(self, url):
+        with self.timings.measure("get page"):
+            r = self.get(url)
+            self._raise_for_status(r)
+            return r.text
+
+    def download(self, url, path, chunk_size=1 << 16):
+        """
+        streams the body of the response to a file
+        the file only appears once complete
+        """
+        tmpfile = f"{path}.part"
+        with self.timings.measure("download igc"), self.get(url, stream=True) as r:
+            self._raise_for_status(r)
+            with open(tmpfile, "wb") as f:
+                for chunk in r.iter_content(chunk_size):
+                    f.write(chunk)
+        os.replace(tmpfile, path)
+
+    def get_bytes(self, url):
+        with self.timings.measure("download igc"):
+            r = self.get(url)
+            self._raise_for_status(r)
+            return r.content
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    def _host_semaphore(self):
+        # semaphores are bound to an event loop, the client may outlive it
+        key = (asyncio.get_running_loop(), urllib.parse.urlsplit(self.base_url).netloc)
+        if key not in self._host_semaphores:
+            self._host_semaphores[key] = asyncio.Semaphore(self.max_per_host)
+        return self._host_semaphores[key]
+
+    async def fetch_text(self, url):
+        async with self._host_semaphore():
+            return await self.run(self.get_text, url)
+
+    async def fetch_to_file(self, url, path):
+        async with self._host_semaphore():
+            await self.run(self.download, url, path)
+
+    async def fetch_bytes(self, url):
+        async with self._host_semaphore():
+            return await self.run(self.get_bytes, url)
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+_ROW_RE = re.compile(r"<tr(?:\s[^>]*)?>(.*?)</tr>", re.S)
+_TD_RE = re.compile(r"<td(?:\s[^>]*)?>(.*?)</td>", re.S)
+_HREF_RE = re.compile(r"<a\s[^>]*href=\"([^\"]*)\"")
+
+
+def parse_listing_page(html):
+    """
+    returns the ids of the flights of a listing page, leaving out the
+    ones flagged with a <font> in their first cell, and the id of its first
+    flight
+    only the rows of the #content table are scanned, without building a DOM
+    """
+    start = html.find('id="content"')
+    if start == -1:
+        raise ValueError("No content in the listing page")
+    # the rows of the tables after it (footer, sidebar) are not flights
+    end = html.find("</table>", start)
+    if end == -1:
+        # truncated page, its rows are all in the content table
+        end = len(html)
     ids = []
     first_id = -1
-    for noline, line in enumerate(soup.find(id="content").findAll("tr")[1:]):
-        id = int(line.td.a["href"].split("/")[-1])
-        if line.findAll("td")[0].font is None:
+    # the first row holds the headers
+    for noline, row in enumerate(_ROW_RE.findall(html, start, end)[1:]):
+        td = _TD_RE.search(row)
+        href = None if td is None else _HREF_RE.search(td.group(1))
+        if href is None:
+            continue
+        id = int(href.group(1).split("/")[-1])
+        if "<font" not in td.group(1):
             ids.append(id)
         if noline == 0:
             first_id = id
@@ -91,24 +311,84 @@ def get_all_flights_in_page(page):
     return ids, first_id
 
 
-def get_all_flights(max_page=-1):
-    page = 0
-    done = False
-    ids = []
+async def fetch_listing_page(client, page):
+    url = f"/cfd/liste?page={page}&sort=desc&order=date"
+    html = await with_retries(
+        lambda: client.fetch_text(url), f"page {page}", timings=client.timings
+    )
+    with client.timings.measure("parse listing"):
+        return await client.run(parse_listing_page, html)
+
+
+async def crawl_flight_ids(client, max_page=-1, known_ids=(), window=None):
+    """
+    fetches the listing pages by windows of concurrent requests, until
+    the end of the listing (the server then serves the last page again),
+    max_page (included, -1 for no limit) or a page holding a known flight
+    as the flights are sorted by descending date, the flights after a known
+    one are assumed to be known as well
+    """
+    if window is None:
+        window = client.max_connections
+    known_ids = set(known_ids)
+    ids = {}
     last_first_id = -1
-    while not done:
-        print(page)
-        ids_temp, first_id = get_all_flights_in_page(page)
-        if first_id == last_first_id:
-            # reached the end
-            done = True
-            break
-        last_first_id = first_id
-        ids.extend(ids_temp)
-        page += 1
-        if page > max_page:
-            break
-    return ids
+    page = 0
+    while max_page < 0 or page <= max_page:
+        pages = range(page, page + window)
+        if max_page >= 0:
+            pages = range(page, min(page + window, max_page + 1))
+        results = await asyncio.gather(*(fetch_listing_page(client, p) for p in pages))
+        for ids_temp, first_id in results:
+            if first_id == last_first_id:
+                # reached the end
+                return list(ids)
+            last_first_id = first_id
+            new_ids = [id for id in ids_temp if id not in known_ids]
+            # pages may overlap if flights are added while crawling
+            ids.update(dict.fromkeys(new_ids))
+            if len(new_ids) < len(ids_temp):
+                return list(ids)
+        page = pages.stop
+        print(f"{page} pages, {len(ids)} flights")
+    return list(ids)
+
+
+def load_known_ids(path):
+    """
+    returns the flight ids known to a previous scrape, path being either
+    its work directory or a json list of flight ids
+    """
+    if os.path.isdir(path):
+        known_ids_file = utils.get_known_ids_file(path)
+        if not os.path.isfile(known_ids_file):
+            # scraped before the known ids were saved
+            known_ids_file = utils.get_flight_ids_file(path)
+        path = known_ids_file
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_flight_ids(workdir, ids, known_ids=()):
+    """
+    saves the flight ids to scrape, then the ones known after this scrape
+    for the next one to stop at them, even if this one found no new flight
+    """
+    with open(utils.get_known_ids_file(workdir), "w") as f:
+        json.dump(sorted(set(known_ids).union(ids)), f)
+    with open(utils.get_flight_ids_file(workdir), "w") as f:
+        json.dump(ids, f)
+
+
+def get_all_flights(max_page=-1, known_ids=(), client=None):
+    own_client = client is None
+    if own_client:
+        client = CFDClient()
+    try:
+        return asyncio.run(crawl_flight_ids(client, max_page, known_ids))
+    finally:
+        if own_client:
+            client.close()
 
 
 def _is_wing_url(href):
@@ -123,80 +403,228 @@ def _is_flight_url(href):
     return href.startswith("/sites/parapente.ffvl.fr/files/igcfiles/")
 
 
-def get_single_flight_data(flight_id, workdir, batch_no):
-    url = f"/cfd/liste/vol/{flight_id}"
-    html = None
-    while html is None:
-        try:
-            html = get_ffvl_no_dns(url).text
-        except requests.RequestException:
-            html = None
-            print(f"Failed to pull id {flight_id}, retrying in 5s")
-            time.sleep(5)
+def parse_flight_page(html):
+    """
+    returns the igc file name and the wing id of a flight page,
+    or None if one of them is missing
+    """
     soup = BeautifulSoup(html, "html.parser").find(id="block-system-main")
     gps_track = soup.find(href=_is_flight_url)
     wing_id = soup.find(href=_is_wing_url)
     if gps_track is None or wing_id is None:
         return None
-    gps_track = gps_track["href"].split("/")[-1]
-    wing_id = wing_id["href"].split("/")[-1]
+    return gps_track["href"].split("/")[-1], wing_id["href"].split("/")[-1]
+
+
+def backoff_delay(attempt, base_delay=1, max_delay=60):
+    """
+    exponential backoff with full jitter
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+async def with_retries(func, description, max_retries=5, timings=None):
+    """
+    awaits func(), retrying with a backoff on network errors
+    the last error is raised once max_retries is reached
+    the retries are counted in timings if given
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await func()
+        except requests.RequestException as e:
+            if attempt == max_retries:
+                raise
+            if timings is not None:
+                timings.count("retry")
+            delay = backoff_delay(attempt)
+            print(f"Failed to pull {description} ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+class ScrapeJournal:
+    """
+    append-only journal of the flights already fetched, one json per line
+    the last line of a flight id wins, its status being "done" or "failed"
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.f = None
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # line truncated by an interruption
+                    continue
+                self.entries[entry["id"]] = entry
+
+    def is_done(self, flight_id):
+        entry = self.entries.get(flight_id)
+        return entry is not None and entry["status"] == "done"
+
+    def failed_ids(self):
+        return [id for id, e in self.entries.items() if e["status"] == "failed"]
+
+    def record(self, flight_id, data, failed=False):
+        entry = {"id": flight_id, "status": "failed" if failed else "done"}
+        entry["data"] = data
+        self.entries[flight_id] = entry
+        if self.f is None:
+            self.f = open(self.path, "a")
+        self.f.write(json.dumps(entry) + "\n")
+        self.f.flush()
+
+    def flight_data(self):
+        return {
+            id: e["data"] for id, e in self.entries.items() if e["status"] == "done"
+        }
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+async def fetch_single_flight_data(client, flight_id, workdir, batch_no, archive=False):
+    """
+    the track is saved in the igc file of the batch directory, or appended
+    to the archive of the batch if archive
+    """
+    url = f"/cfd/liste/vol/{flight_id}"
+    html = await with_retries(
+        lambda: client.fetch_text(url), f"id {flight_id}", timings=client.timings
+    )
+    with client.timings.measure("parse flight"):
+        flight = await client.run(parse_flight_page, html)
+    if flight is None:
+        client.timings.count("flight without track")
+        return None
+    gps_track, wing_id = flight
+
+    if archive:
+        track_archive = open_archive(utils.get_track_archive_file(workdir, batch_no))
+        # the archive is read, compressed into and appended to by the
+        # executor, not to block the other workers
+        if not await client.run(operator.contains, track_archive, gps_track):
+            data = await fetch_single_flight_track_bytes(client, gps_track)
+            await client.run(track_archive.add, gps_track, data)
+        gps = os.path.join(str(batch_no) + ARCHIVE_SUFFIX, gps_track)
+        return {"gps": gps, "wing": wing_id}
 
     igcfile_path = os.path.join(utils.get_track_save_dir(workdir, batch_no), gps_track)
-    get_single_flight_track(gps_track, igcfile_path)
+    if not os.path.isfile(igcfile_path):
+        await fetch_single_flight_track(client, gps_track, igcfile_path)
     return {"gps": os.path.join(str(batch_no), gps_track), "wing": wing_id}
 
 
-def get_single_flight_track(filename, path):
+async def fetch_single_flight_track(client, filename, path):
     url = f"/sites/parapente.ffvl.fr/files/igcfiles/{filename}"
-    igcfile = None
-    while igcfile is None:
-        try:
-            igcfile = get_ffvl_no_dns(url).text
-        except requests.RequestException:
-            igcfile = None
-            print(f"Failed to pull id {filename}, retrying in 5s")
-            time.sleep(5)
-    with open(path, "w") as f:
-        f.write(igcfile)
+    await with_retries(
+        lambda: client.fetch_to_file(url, path),
+        f"id {filename}",
+        timings=client.timings,
+    )
+
 
+async def fetch_single_flight_track_bytes(client, filename):
+    url = f"/sites/parapente.ffvl.fr/files/igcfiles/{filename}"
+    return await with_retries(
+        lambda: client.fetch_bytes(url),
+        f"id {filename}",
+        timings=client.timings,
+    )
 
-def get_flight_data(outdir, ids, batch_size=1000, save_data=True):
+
+async def fetch_flight_data(
+    client,
+    outdir,
+    ids,
+    batch_size,
+    journal,
+    bar=None,
+    on_flight=None,
+    archive=False,
+):
+    """
+    fetches the flights with a fixed number of concurrent workers, so that
+    the batches (which only define the output directories) overlap
+    every fetched flight is appended to the journal, the flights that
+    can't be fetched are recorded as failed to be retried on resume
+    on_flight is awaited with the id and the data of every fetched flight,
+    the worker waiting for it before fetching another flight
+    the tracks are appended to the archives of their batches if archive
+    """
+    queue = asyncio.Queue()
+    for no, id in enumerate(ids):
+        if not journal.is_done(id):
+            queue.put_nowait((no // batch_size, id))
+
+    async def worker():
+        while not queue.empty():
+            batch_no, id = queue.get_nowait()
+            if archive:
+                os.makedirs(os.path.join(outdir, "igcfiles"), exist_ok=True)
+            else:
+                os.makedirs(utils.get_track_save_dir(outdir, batch_no), exist_ok=True)
+            try:
+                data = await fetch_single_flight_data(
+                    client, id, outdir, batch_no, archive
+                )
+                journal.record(id, data)
+            except Exception as e:
+                client.timings.count(f"exception {type(e).__name__}")
+                print(
+                    f"An error happend while retreiving the data : {''.join(traceback.format_exception(*sys.exc_info()))}"
+                )
+                journal.record(id, None, failed=True)
+            else:
+                if on_flight is not None:
+                    await on_flight(id, data)
+            if bar is not None:
+                bar.next()
+
+    await asyncio.gather(*(worker() for _ in range(client.max_connections)))
+
+
+def get_flight_data(outdir, ids, batch_size=1000, client=None, archive=False):
+    """
+    fetches the flights not already in the journal of outdir,
+    then adds the fetched flights to the flight index
+    """
+    own_client = client is None
+    if own_client:
+        client = CFDClient()
+    journal = ScrapeJournal(utils.get_flight_journal_file(outdir))
+    journal.load()
     bar = Bar(
         "Processing",
-        max=len(ids),
+        max=len([id for id in ids if not journal.is_done(id)]),
         suffix="%(percent).1f %% -- %(elapsed)d s -- %(eta)d s",
     )
-    flight_data = {}
-    for batch_no in range(0, len(ids) // batch_size + 1):
-        os.makedirs(utils.get_track_save_dir(outdir, batch_no))
-        with concurrent.futures.ThreadPoolExecutor(max_workers=15) as executor:
-            futures = {}
-            for id in ids[batch_no * batch_size : (batch_no + 1) * batch_size]:
-                future = executor.submit(
-                    lambda x: get_single_flight_data(x, outdir, batch_no), id
-                )
-                future.add_done_callback(lambda x: bar.next())
-                futures[id] = future
-            try:
-                for id, future in futures.items():
-                    try:
-                        res = future.result()
-                    except Exception as e:
-                        print(
-                            f"An error happend while retreiving the data : {''.join(traceback.format_exception(*sys.exc_info()))}"
-                        )
-                    flight_data[id] = res
-
-            except KeyboardInterrupt:
-                bar.finish()
-                for future in futures.values():
-                    future.cancel()
-                break
-
-        with open(os.path.join(outdir, "flight_data.json"), "w") as f:
-            json.dump(flight_data, f)
-
-    bar.finish()
+    try:
+        asyncio.run(
+            fetch_flight_data(
+                client, outdir, ids, batch_size, journal, bar, archive=archive
+            )
+        )
+    finally:
+        bar.finish()
+        if own_client:
+            client.close()
+        journal.close()
+        flight_data = journal.flight_data()
+        with FlightIndex(utils.get_flight_index_file(outdir)) as index:
+            index.add_flights(flight_data.items())
+    failed = journal.failed_ids()
+    if len(failed) > 0:
+        print(f"{len(failed)} flights failed, resume to retry them")
     return flight_data
 
 
@@ -209,6 +637,44 @@ if __name__ == "__main__":
         default="",
         help="The directory where to save the data.",
     )
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default="https://54.36.26.32",
+        help="The server to fetch the flights from (e.g. a local mirror).",
+    )
+    parser.add_argument(
+        "-c",
+        "--connections",
+        type=int,
+        default=15,
+        help="The maximum number of concurrent connections.",
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted scrape in the given work directory.",
+    )
+    parser.add_argument(
+        "--max-page",
+        type=int,
+        default=0,
+        help="The last listing page to crawl, -1 to crawl them all.",
+    )
+    parser.add_argument(
+        "--known-ids",
+        type=str,
+        default=None,
+        help="Work directory (or json list of flight ids) of a previous scrape, "
+        "the crawl stops at the flights it knew.",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Store the tracks in one compressed archive per batch "
+        "(smaller, but slower to read from a local disk).",
+    )
     args = parser.parse_args()
 
     outdir = args.workdir
@@ -219,16 +685,37 @@ if __name__ == "__main__":
 
     outdir = os.path.abspath(outdir)
 
-    if os.path.exists(outdir):
-        print(f"{outdir} already exists. Exiting.")
+    if os.path.exists(outdir) and not args.resume:
+        print(f"{outdir} already exists, use --resume to continue it. Exiting.")
         exit(1)
 
-    os.makedirs(outdir)
+    os.makedirs(outdir, exist_ok=True)
 
-    print("Step 1 : Getting all flight ids")
-    ids = get_all_flights(0)
+    client = CFDClient(
+        args.base_url,
+        max_connections=args.connections,
+        max_per_host=args.connections,
+    )
+    ids_file = utils.get_flight_ids_file(outdir)
+    if os.path.isfile(ids_file):
+        # the flight ids are kept so that a resumed scrape uses the same batches
+        print("Step 1 : Loading the flight ids of the interrupted scrape")
+        with open(ids_file, "r") as f:
+            ids = json.load(f)
+    else:
+        print("Step 1 : Getting all flight ids")
+        known_ids = []
+        if args.known_ids is not None:
+            known_ids = load_known_ids(args.known_ids)
+        ids = get_all_flights(args.max_page, known_ids, client)
+        save_flight_ids(outdir, ids, known_ids)
     print(ids)
     print("Step 2 : Getting all flight datas")
-    get_flight_data(outdir, ids)
+    try:
+        get_flight_data(outdir, ids, client=client, archive=args.archive)
+    finally:
+        client.close()
+        client.timings.print_summary()
+        client.timings.save(utils.get_timings_file(outdir, "cfd_fetcher"))
     print("Done")
     exit(0)
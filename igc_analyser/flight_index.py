@@ -0,0 +1,193 @@
+"""
+Index of the flights of a work directory, in a SQLite database
+
+It replaces flight_data.json: the flights are added as they are fetched,
+their analysis outcome is recorded by step 1, and the usual selections
+(the flights of a wing, the flights not analysed yet...) are indexed
+queries instead of a walk of the whole json.
+"""
+
+import json
+import os
+import sqlite3
+
+from . import utils
+from .igc_archive import ARCHIVE_SUFFIX
+
+# analysis status of a flight, NULL if it has not been analysed yet
+STATUS_DONE = "done"
+STATUS_REJECTED = "rejected"
+STATUS_ERROR = "error"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS flights (
+    flight_id INTEGER PRIMARY KEY,
+    wing_id INTEGER NOT NULL,
+    batch INTEGER,
+    gps TEXT NOT NULL,
+    date INTEGER,
+    nb_fixes INTEGER,
+    sanity INTEGER,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS flights_wing ON flights (wing_id);
+CREATE INDEX IF NOT EXISTS flights_status ON flights (status);
+"""
+
+
+def get_batch(gps):
+    """
+    returns the batch number of a flight from the path of its igc file,
+    or of its track within the archive of its batch
+    """
+    batch = os.path.dirname(gps)
+    if batch.endswith(ARCHIVE_SUFFIX):
+        batch = batch[: -len(ARCHIVE_SUFFIX)]
+    return int(batch) if batch.isdigit() else None
+
+
+class FlightIndex:
+    """
+    the changes are only saved by commit, or when the index is closed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM flights").fetchone()[0]
+
+    def add_flights(self, flights):
+        """
+        adds or updates flights given as (flight_id, data) pairs, data being
+        {"gps": ..., "wing": ...} as returned by the fetcher
+        the flights whose data is None or incomplete are left out
+        the analysis outcome of a flight is reset if its igc file changed
+        """
+        self.conn.executemany(
+            """
+            INSERT INTO flights (flight_id, wing_id, batch, gps) VALUES (?, ?, ?, ?)
+            ON CONFLICT (flight_id) DO UPDATE SET
+                wing_id = excluded.wing_id,
+                batch = excluded.batch,
+                gps = excluded.gps,
+                date = CASE WHEN gps = excluded.gps THEN date END,
+                nb_fixes = CASE WHEN gps = excluded.gps THEN nb_fixes END,
+                sanity = CASE WHEN gps = excluded.gps THEN sanity END,
+                status = CASE WHEN gps = excluded.gps THEN status END
+            """,
+            (
+                (int(flight_id), int(data["wing"]), get_batch(data["gps"]), data["gps"])
+                for flight_id, data in flights
+                if data is not None and "gps" in data and "wing" in data
+            ),
+        )
+
+    def add_flight(self, flight_id, data):
+        self.add_flights([(flight_id, data)])
+
+    def set_analysis(self, flight_id, status, sanity=None, date=None, nb_fixes=None):
+        self.conn.execute(
+            """
+            UPDATE flights SET status = ?, sanity = ?, date = ?, nb_fixes = ?
+            WHERE flight_id = ?
+            """,
+            (status, sanity, date, nb_fixes, int(flight_id)),
+        )
+
+    def rename_track(self, flight_id, gps):
+        """
+        changes the path of the igc file of a flight moved elsewhere, its
+        analysis outcome being kept
+        """
+        self.conn.execute(
+            "UPDATE flights SET gps = ?, batch = ? WHERE flight_id = ?",
+            (gps, get_batch(gps), int(flight_id)),
+        )
+
+    def _select(self, where="", params=()):
+        return [
+            dict(row)
+            for row in self.conn.execute(
+                f"SELECT * FROM flights {where} ORDER BY flight_id", params
+            )
+        ]
+
+    def get(self, flight_id):
+        rows = self._select("WHERE flight_id = ?", (int(flight_id),))
+        return rows[0] if len(rows) > 0 else None
+
+    def all(self):
+        return self._select()
+
+    def of_wing(self, wing_id):
+        return self._select("WHERE wing_id = ?", (int(wing_id),))
+
+    def with_status(self, status):
+        """
+        returns the flights of a status, None for the flights not analysed
+        """
+        if status is None:
+            return self._select("WHERE status IS NULL")
+        return self._select("WHERE status = ?", (status,))
+
+    def pending(self):
+        """
+        returns the flights to be analysed whatever their manifest: the ones
+        never analysed and the ones whose analysis failed
+        """
+        return self._select("WHERE status IS NULL OR status = ?", (STATUS_ERROR,))
+
+    def analysed(self):
+        """
+        returns the flights analysed, accepted or rejected
+        """
+        return self._select("WHERE status IN (?, ?)", (STATUS_DONE, STATUS_REJECTED))
+
+    def wing_ids(self):
+        return [
+            row[0]
+            for row in self.conn.execute(
+                "SELECT DISTINCT wing_id FROM flights ORDER BY wing_id"
+            )
+        ]
+
+    def import_json(self, path):
+        """
+        adds the flights of a legacy flight_data.json
+        """
+        with open(path, "r") as f:
+            self.add_flights(json.load(f).items())
+        self.commit()
+
+
+def open_flight_index(workdir):
+    """
+    opens the flight index of a work directory, creating it from the
+    flight_data.json of the work directories prior to the index if needed
+    """
+    path = utils.get_flight_index_file(workdir)
+    json_file = utils.get_flight_json_file(workdir)
+    migrate = not os.path.isfile(path) and os.path.isfile(json_file)
+    index = FlightIndex(path)
+    if migrate:
+        print(f"Importing {json_file} into the flight index")
+        index.import_json(json_file)
+    return index
@@ -0,0 +1,216 @@
+"""
+Vectorized distances and bearings between arrays of points
+
+Three modes trade accuracy for speed, their errors being measured against
+the ellipsoid by bench.py on synthetic tracks:
+- haversine: great circle on the sphere of mean radius, the historical
+  computation. Off by up to 0.6% from the ellipsoid in distance (0.3% at
+  the latitudes of the Alps, depending on the direction) and 0.2 degree
+  in bearing
+- equirectangular: local projection on the plane tangent at the mean
+  latitude of the track, only one cosine being computed for the whole
+  track. Its error adds tan(ref_lat) * |lat - ref_lat| (radians) to the
+  one of haversine on the east-west distances, i.e. 0.2% per 0.1 degree
+  of latitude away from ref_lat at 46 degrees
+- vincenty: inverse problem of Vincenty on the WGS84 ellipsoid, accurate
+  to a fraction of a millimeter but about twice slower than haversine on
+  the steps of a track (and more on long lines, needing more iterations),
+  and not converging for nearly antipodal points
+
+The latitudes and longitudes are in degrees, the distances in meters and
+the bearings in degrees clockwise from the north, in [0, 360).
+"""
+
+import numpy as np
+
+HAVERSINE = "haversine"
+EQUIRECTANGULAR = "equirectangular"
+VINCENTY = "vincenty"
+MODES = (HAVERSINE, EQUIRECTANGULAR, VINCENTY)
+
+# mean radius of the earth, as the haversine package
+EARTH_RADIUS_KM = 6371.0088
+EARTH_RADIUS = EARTH_RADIUS_KM * 1000
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+
+def check_mode(mode):
+    if mode not in MODES:
+        raise ValueError(f"Unknown geodesy mode {mode}, must be one of {MODES}")
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    same result as haversine.haversine_vector (in meters), without its
+    checks of the coordinates
+    """
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+    d = (
+        np.sin((lat2 - lat1) * 0.5) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+    )
+    # multiplied in this order to round as the haversine package
+    return EARTH_RADIUS_KM * (2 * np.arcsin(np.sqrt(d))) * 1000
+
+
+def spherical_bearing(lat1, lon1, lat2, lon2):
+    """
+    initial bearing of the great circle from point 1 to point 2
+    """
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    diff_lon = np.radians(lon2 - lon1)
+    bearing = np.arctan2(
+        np.sin(diff_lon) * np.cos(lat2),
+        np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(diff_lon),
+    )
+    return np.degrees(bearing) % 360
+
+
+def project(lat, lon, ref_lat):
+    """
+    returns the x (east) and y (north) coordinates in meters of the points
+    on the plane tangent at ref_lat
+    """
+    x = np.radians(lon) * (EARTH_RADIUS * np.cos(np.radians(ref_lat)))
+    y = np.radians(lat) * EARTH_RADIUS
+    return x, y
+
+
+def vincenty(lat1, lon1, lat2, lon2, max_iter=200, tolerance=1e-12):
+    """
+    returns the distances and initial bearings on the WGS84 ellipsoid
+    the points whose iteration did not converge (nearly antipodal ones)
+    keep the values of the last iteration
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.asarray(v, dtype=float) for v in (lat1, lon1, lat2, lon2))
+    )
+    diff_lon = np.radians(lon2 - lon1)
+    u1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lamb = diff_lon
+    for _ in range(max_iter):
+        sin_lamb, cos_lamb = np.sin(lamb), np.cos(lamb)
+        sin_sigma = np.hypot(
+            cos_u2 * sin_lamb, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lamb
+        )
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lamb
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        # coincident points have a null sin_sigma, and equatorial lines a
+        # null cos_sq_alpha
+        sin_alpha = np.divide(
+            cos_u1 * cos_u2 * sin_lamb,
+            sin_sigma,
+            out=np.zeros_like(sin_sigma),
+            where=sin_sigma != 0,
+        )
+        cos_sq_alpha = 1 - sin_alpha**2
+        cos_2sigma_m = cos_sigma - np.divide(
+            2 * sin_u1 * sin_u2,
+            cos_sq_alpha,
+            out=np.zeros_like(cos_sigma),
+            where=cos_sq_alpha != 0,
+        )
+        c = WGS84_F / 16 * cos_sq_alpha * (4 + WGS84_F * (4 - 3 * cos_sq_alpha))
+        previous = lamb
+        lamb = diff_lon + (1 - c) * WGS84_F * sin_alpha * (
+            sigma
+            + c
+            * sin_sigma
+            * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m**2))
+        )
+        if np.all(np.abs(lamb - previous) < tolerance):
+            break
+
+    u_sq = cos_sq_alpha * (WGS84_A**2 - WGS84_B**2) / WGS84_B**2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = (
+        b
+        * sin_sigma
+        * (
+            cos_2sigma_m
+            + b
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+                - b
+                / 6
+                * cos_2sigma_m
+                * (-3 + 4 * sin_sigma**2)
+                * (-3 + 4 * cos_2sigma_m**2)
+            )
+        )
+    )
+    distance = WGS84_B * a * (sigma - delta_sigma)
+    bearing = np.arctan2(
+        cos_u2 * np.sin(lamb), cos_u1 * sin_u2 - sin_u1 * cos_u2 * np.cos(lamb)
+    )
+    return distance, np.degrees(bearing) % 360
+
+
+def distance(lat1, lon1, lat2, lon2, mode=HAVERSINE, ref_lat=None):
+    """
+    ref_lat is the latitude of the equirectangular projection, the mean of
+    lat1 if None (i.e. the mean latitude of the track when lat1 holds its
+    fixes)
+    """
+    check_mode(mode)
+    if mode == HAVERSINE:
+        return haversine(lat1, lon1, lat2, lon2)
+    if mode == VINCENTY:
+        return vincenty(lat1, lon1, lat2, lon2)[0]
+    if ref_lat is None:
+        ref_lat = np.mean(lat1)
+    x1, y1 = project(lat1, lon1, ref_lat)
+    x2, y2 = project(lat2, lon2, ref_lat)
+    return np.hypot(x2 - x1, y2 - y1)
+
+
+def bearing(lat1, lon1, lat2, lon2, mode=HAVERSINE, ref_lat=None):
+    """
+    initial bearing from point 1 to point 2, 0 for coincident points
+    """
+    check_mode(mode)
+    if mode == HAVERSINE:
+        return spherical_bearing(lat1, lon1, lat2, lon2)
+    if mode == VINCENTY:
+        return vincenty(lat1, lon1, lat2, lon2)[1]
+    if ref_lat is None:
+        ref_lat = np.mean(lat1)
+    x1, y1 = project(lat1, lon1, ref_lat)
+    x2, y2 = project(lat2, lon2, ref_lat)
+    return np.degrees(np.arctan2(x2 - x1, y2 - y1)) % 360
+
+
+def distance_and_bearing(lat1, lon1, lat2, lon2, mode=HAVERSINE, ref_lat=None):
+    """
+    same as distance and bearing, sharing their computations
+    """
+    check_mode(mode)
+    if mode == HAVERSINE:
+        return (
+            haversine(lat1, lon1, lat2, lon2),
+            spherical_bearing(lat1, lon1, lat2, lon2),
+        )
+    if mode == VINCENTY:
+        return vincenty(lat1, lon1, lat2, lon2)
+    if ref_lat is None:
+        ref_lat = np.mean(lat1)
+    x1, y1 = project(lat1, lon1, ref_lat)
+    x2, y2 = project(lat2, lon2, ref_lat)
+    return (
+        np.hypot(x2 - x1, y2 - y1),
+        np.degrees(np.arctan2(x2 - x1, y2 - y1)) % 360,
+    )
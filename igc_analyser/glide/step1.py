@@ -1,47 +1,126 @@
 """
-Analyses the raw flight data in order to extract 
+Analyses the raw flight data in order to extract
 the glide angle throughout the flight
 """
 
 import argparse
+import functools
 import json
 import logging
 import multiprocessing as mp
 import os
-import random
+import pickle
 import time
+import traceback
 
-from .. import utils
+import numpy as np
+
+from .. import geodesy, utils
+from ..flight_index import (
+    STATUS_DONE,
+    STATUS_ERROR,
+    STATUS_REJECTED,
+    open_flight_index,
+)
+from ..glide_store import VALUES_DTYPE, GlideStore
 from ..igc_analyser import TrackAnalyser
+from ..igc_archive import map_track, track_stat
+from ..manifest import AnalysisManifest, file_signature
+from ..prescreen import prescreen_track
+from ..shared_arrays import share_array, start_sharing, take_shared_array
+from ..timings import Timings
+from ..wing_stats import FlightSums, WingAccumulators
 
 logging.basicConfig(level=logging.INFO)
 
 
-def process_single_file(path):
-    t = TrackAnalyser(path)
-    # find wether baro can be used or not and if we can default to gnss altitude
-    for use_baro in (True, False):
-        sanity = t.check_track_sanity(use_baro=use_baro)
-        if sanity == 0:
-            break
+def process_single_file(path, use_cache=False, params=None, timings=None, raw=None):
+    """
+    returns the glide angles (None if the track is rejected), the sampling
+    and the day of the track, its sanity code and its number of fixes
+    raw is the content of the file if already read, see map_track
+    """
+    params = params or {}
+    if timings is None:
+        timings = Timings()
+    # most of the rejected tracks are caught without parsing them
+    with timings.measure("prescreen"):
+        screened = prescreen_track(path, raw=raw)
+    if screened is not None:
+        timings.count(f"prescreened sanity {screened.sanity}")
+        timings.count(f"rejected sanity {screened.sanity}")
+        return (
+            None,
+            screened.time_delta,
+            screened.day.toordinal(),
+            screened.sanity,
+            screened.nb_fixes,
+        )
+    with timings.measure("parse"):
+        t = TrackAnalyser(path, use_cache=use_cache, raw=raw, **params)
+    with timings.measure("sanity"):
+        use_baro, sanity = t.select_altitude_source()
     if sanity != 0:
-        if t.check_track_sanity(use_baro=use_baro):
-            logging.debug(
-                f"{'/'.join(path.split('/')[-2:])} is not safe to extract data from, sanity : {sanity}"
-            )
-            return None, None
-    t.process(use_baro=use_baro)
-    t.calc_glide_mask()
-    ga_filt = [val for pos, val in enumerate(t.glide_angles) if t.glide_mask[pos] == 1]
-    outfile = path.replace(".igc", ".json")
-    with open(outfile, "w") as f:
-        json.dump(
-            {
-                "glide_angles": ga_filt,
-                "sampling": t.track_mean_time_delta,
-            },
-            f,
+        logging.debug(
+            f"{'/'.join(path.split('/')[-2:])} is not safe to extract data from, sanity : {sanity}"
         )
+        timings.count(f"rejected sanity {sanity}")
+        ga_filt = None
+    else:
+        with timings.measure("process"):
+            t.process(use_baro=use_baro)
+        with timings.measure("mask"):
+            t.calc_glide_mask()
+            ga_filt = t.get_glide_samples()
+    return (
+        ga_filt,
+        t.track_mean_time_delta,
+        t.track.day.toordinal(),
+        sanity,
+        t.track.data_formated.shape[0],
+    )
+
+
+def pack_glide_angles(ga_filt, stats_only=False):
+    """
+    returns what is sent back to the parent process instead of the glide
+    angles: the share_array of them (a reference to a shared memory copy of
+    the large ones), or only their number, sum and sum of squares if
+    stats_only
+    """
+    # rounded as in the store, so that both ways give the same statistics
+    ga_filt = np.asarray(ga_filt, dtype=VALUES_DTYPE)
+    if not stats_only:
+        return share_array(ga_filt)
+    ga_filt = ga_filt.astype(np.float64)
+    return ga_filt.shape[0], np.sum(ga_filt), np.sum(np.square(ga_filt))
+
+
+def process_flight(job, use_cache=False, params=None, stats_only=False):
+    """
+    returns the job, the signature of its igc file, the result of
+    process_single_file with the glide angles packed by pack_glide_angles,
+    the traceback of the exception it raised if any (the result is then
+    None) and the timings of the flight
+    """
+    flight_id, wing_id, relpath, path = job
+    timings = Timings()
+    signature, result, error = None, None, None
+    with timings.measure("flight"):
+        try:
+            # the file is read once for its hash, the prescreen and the parse
+            with map_track(path) as raw:
+                signature = file_signature(path, raw)
+                ga_filt, *track_info = process_single_file(
+                    path, use_cache, params, timings, raw
+                )
+            if ga_filt is not None:
+                ga_filt = pack_glide_angles(ga_filt, stats_only)
+            result = ga_filt, *track_info
+        except Exception as e:
+            timings.count(f"exception {type(e).__name__}")
+            error = traceback.format_exc()
+    return job, signature, result, error, timings
 
 
 def format_eta(secs):
@@ -50,43 +129,243 @@ def format_eta(secs):
     return ":".join(hms)
 
 
-def process_folder(igc_indir, flights, njobs):
-    no_file = -1
+class StoreSink:
+    """
+    saves the glide angles of the flights in the store, and the flights
+    in the manifest
+    """
+
+    stats_only = False
+
+    def __init__(self, store, manifest, params):
+        self.store = store
+        self.manifest = manifest
+        self.params = params
+
+    def __enter__(self):
+        self.writer = self.store.open_writer()
+        return self
+
+    def __exit__(self, *exc):
+        self.writer.close()
+
+    def add(self, job, signature, result):
+        flight_id, wing_id, relpath, _ = job
+        ga_filt, sampling, date, _, _ = result
+        previous = self.manifest.get(flight_id)
+        offset, length = None, 0
+        if ga_filt is not None:
+            ga_filt = take_shared_array(ga_filt)
+            offset = self.writer.append(flight_id, wing_id, ga_filt, sampling, date)
+            length = len(ga_filt)
+        elif previous is not None and previous["length"] > 0:
+            # the flight is now rejected, discard its former glide angles
+            self.writer.append(flight_id, wing_id, [], 0, 0)
+        self.manifest.update(flight_id, relpath, self.params, signature, offset, length)
+
+
+class AccumulatorSink:
+    """
+    gathers the sums of the glide angles of the flights, to be aggregated
+    into per wing statistics without writing any intermediary file
+    """
+
+    stats_only = True
+
+    def __init__(self):
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def add(self, job, signature, result):
+        flight_id, wing_id, _, _ = job
+        sums, sampling, date, _, _ = result
+        if sums is not None:
+            self.rows.append((flight_id, wing_id, date, sampling, *sums))
+
+    def get_accumulators(self):
+        if len(self.rows) == 0:
+            return WingAccumulators()
+        return WingAccumulators.from_flight_sums(
+            FlightSums.from_arrays(*(np.array(column) for column in zip(*self.rows)))
+        )
+
+
+def get_chunksize(nb_jobs, njobs):
+    """
+    flights are sent to the workers by chunks to cut the inter process
+    overhead on small tracks, but only if there are far more flights than
+    workers so that the workers still finish together
+    """
+    if njobs is None:
+        njobs = os.cpu_count()
+    return max(1, min(16, nb_jobs // (njobs * 16)))
+
+
+def record_analysis(index, job, result, error):
+    """
+    records the outcome of the analysis of a flight in the flight index
+    """
+    if error is not None:
+        index.set_analysis(job[0], STATUS_ERROR)
+        return
+    ga_filt, sampling, date, sanity, nb_fixes = result
+    status = STATUS_REJECTED if ga_filt is None else STATUS_DONE
+    index.set_analysis(job[0], status, sanity, date, nb_fixes)
+
+
+def process_folder(
+    igc_indir, index, njobs, sink, manifest, params, use_cache=False, timings=None
+):
+    """
+    analyses the flights pending in the index, and the analysed ones
+    whose parameters or igc file changed since their entry in the manifest,
+    their results being added to the sink and their outcome to the index
+    returns the errors raised by the analysis of some flights, which are
+    left with the error status to be retried by the next run
+    """
+    if timings is None:
+        timings = Timings()
     time_start = time.time()
-    paths = []
-    for flight_id in flights:
-        no_file += 1
-        if flights[flight_id] is None:
-            logging.debug(f"{flight_id} has incomplete data")
-            continue
-        if not "gps" in flights[flight_id] or not "wing" in flights[flight_id]:
-            logging.debug(f"{flight_id} has incomplete data")
-            continue
-        path = os.path.join(igc_indir, flights[flight_id]["gps"])
-        paths.append(path)
-    # shuffle the paths to improve ETA estimate
-    # without it, the first files are often the smaller, thus the ETA was underestimated
-    paths = random.shuffle(paths)
-
-    p = mp.Pool(njobs)
-    rs = p.imap_unordered(process_single_file, paths)
-    percentage = 0
-    while percentage < 0.999:
-        percentage = rs._index / len(paths)
-        elapsed_time = time.time() - time_start
-        eta = 1000000000
-        if percentage != 0:
-            eta = int(elapsed_time / percentage * (1 - percentage))
-        print(f"{round(percentage*100,1)} % - ETA {format_eta(eta)}")
-        time.sleep(1)
-    p.close()
-    p.join()
-
-
-def main(igc_indir, flight_infile, njobs):
-    with open(flight_infile, "r") as f:
-        flights = json.load(f)
-    flights = process_folder(igc_indir, flights, njobs)
+    with timings.measure("select flights"):
+        flights = index.pending()
+        no_pending = len(flights)
+        no_up_to_date = 0
+        for flight in index.analysed():
+            if manifest.is_up_to_date(flight["flight_id"], flight["gps"], params):
+                no_up_to_date += 1
+            else:
+                flights.append(flight)
+    jobs = [
+        (
+            flight["flight_id"],
+            flight["wing_id"],
+            flight["gps"],
+            os.path.join(igc_indir, flight["gps"]),
+        )
+        for flight in flights
+    ]
+    logging.info(
+        f"{no_up_to_date} flights up to date, {len(jobs)} to process "
+        f"({no_pending} not analysed or failed)"
+    )
+    # the processing time is about proportional to the file size:
+    # the largest files first so that no worker is left with a long one at the end
+    sizes = {job[0]: (track_stat(job[3]) or (0,))[0] for job in jobs}
+    jobs.sort(key=lambda job: sizes[job[0]], reverse=True)
+    total_size = max(1, sum(sizes.values()))
+
+    errors = []
+    size_done = 0
+    last_print = 0
+    start_sharing()
+    with mp.Pool(njobs) as p, sink:
+        rs = p.imap_unordered(
+            functools.partial(
+                process_flight,
+                use_cache=use_cache,
+                params=params,
+                stats_only=sink.stats_only,
+            ),
+            jobs,
+            chunksize=get_chunksize(len(jobs), njobs),
+        )
+        for no_done, (job, signature, result, error, flight_timings) in enumerate(
+            rs, 1
+        ):
+            timings.merge(flight_timings)
+            if error is not None:
+                logging.warning(f"{job[2]} could not be analysed")
+                errors.append(
+                    {"flight_id": job[0], "relpath": job[2], "traceback": error}
+                )
+            else:
+                with timings.measure("store"):
+                    sink.add(job, signature, result)
+            record_analysis(index, job, result, error)
+            size_done += sizes[job[0]]
+            if time.time() - last_print > 1 or no_done == len(jobs):
+                last_print = time.time()
+                index.commit()
+                # the remaining time is estimated from the remaining bytes
+                percentage = max(size_done / total_size, 1e-6)
+                elapsed_time = last_print - time_start
+                eta = int(elapsed_time / percentage * (1 - percentage))
+                print(
+                    f"{no_done}/{len(jobs)} flights - {round(percentage*100,1)} % - "
+                    f"{len(errors)} errors - ETA {format_eta(eta)}"
+                )
+    return errors
+
+
+def main(
+    igc_indir,
+    index,
+    store_dir,
+    manifest_file,
+    njobs,
+    use_cache=False,
+    params=None,
+    full=False,
+    timings_file=None,
+    errors_file=None,
+    stat_file=None,
+):
+    """
+    analyses the flights of a FlightIndex
+    if stat_file is given, the per wing statistics of all the flights are
+    directly written to it as step 2 would, the store and the manifest
+    being left untouched
+    """
+    timings = Timings()
+    manifest = AnalysisManifest(manifest_file, igc_indir)
+    params = TrackAnalyser.resolve_params(**(params or {}))
+    if stat_file is not None:
+        sink = AccumulatorSink()
+    else:
+        store = GlideStore(store_dir)
+        if full:
+            store.clear()
+        else:
+            manifest.load()
+        sink = StoreSink(store, manifest, params)
+    errors = []
+    try:
+        errors = process_folder(
+            igc_indir, index, njobs, sink, manifest, params, use_cache, timings
+        )
+    finally:
+        index.commit()
+        if not sink.stats_only:
+            # saved even on interruption as the store already holds the results
+            with timings.measure("manifest save"):
+                manifest.save()
+        timings.print_summary()
+        if timings_file is not None:
+            timings.save(timings_file)
+    if len(errors) > 0:
+        print(f"{len(errors)} flights could not be analysed, they will be retried")
+    if errors_file is not None:
+        with open(errors_file, "w") as f:
+            json.dump(errors, f, indent=2)
+    if stat_file is not None:
+        with open(stat_file, "wb") as f:
+            pickle.dump(sink.get_accumulators().to_wings_perf(), f)
+
+
+def parse_param(text):
+    name, value = text.split("=")
+    # the geodesy mode has an option of its own
+    numeric_params = [p for p in TrackAnalyser.PARAMS if p != "geodesy_mode"]
+    if name not in numeric_params:
+        raise argparse.ArgumentTypeError(
+            f"Unknown parameter {name}, must be one of {numeric_params}"
+        )
+    return name, float(value)
 
 
 if __name__ == "__main__":
@@ -95,17 +374,68 @@ if __name__ == "__main__":
     parser.add_argument(
         "-j",
         "--jobs",
+        type=int,
         default=None,
         help="Parallel jobs number. Default: Number of cores",
     )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Keep a binary cache of the decoded tracks next to the igc files, "
+        "faster to load than the long tracks it duplicates",
+    )
+    parser.add_argument(
+        "-p",
+        "--param",
+        type=parse_param,
+        action="append",
+        default=[],
+        help="Override a TrackAnalyser parameter, e.g. -p max_turn=12",
+    )
+    parser.add_argument(
+        "--geodesy",
+        choices=geodesy.MODES,
+        default=geodesy.HAVERSINE,
+        help="Computation of the distances and headings, see geodesy.py",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Analyse all the flights again, even the ones already up to date",
+    )
+    parser.add_argument(
+        "--stats-only",
+        action="store_true",
+        help="Directly compute the per wing statistics of step 2 in memory, "
+        "without saving the glide angles (no incremental runs nor step 2 filters)",
+    )
     args = parser.parse_args()
 
     workdir = os.path.abspath(args.workdir)
     igc_indir = os.path.join(workdir, "igcfiles")
-    flight_infile = utils.get_flight_json_file(workdir)
+    store_dir = utils.get_glide_store_dir(workdir)
+    manifest_file = utils.get_manifest_file(workdir)
 
-    if not os.path.exists(igc_indir) or not os.path.isfile(flight_infile):
+    if not os.path.exists(igc_indir):
         print("The input directory is invalid. Exiting.")
         exit(1)
 
-    main(igc_indir, flight_infile, args.jobs)
+    index = open_flight_index(workdir)
+    if len(index) == 0:
+        print("The work directory has no flight. Exiting.")
+        exit(1)
+
+    main(
+        igc_indir,
+        index,
+        store_dir,
+        manifest_file,
+        args.jobs,
+        args.cache,
+        dict(args.param, geodesy_mode=args.geodesy),
+        args.full,
+        utils.get_timings_file(workdir, "step1"),
+        utils.get_errors_file(workdir, "step1"),
+        utils.get_stat_file(workdir) if args.stats_only else None,
+    )
+    index.close()
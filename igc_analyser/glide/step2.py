@@ -1,88 +1,138 @@
 """
-Realizes a statistical study over the glide angles calculated before 
+Realizes a statistical study over the glide angles calculated before
 in order to extract for each wing the average glide angle
 as well as the standard deviation
 """
 
 import argparse
-import json
+import datetime as dt
 import os
 import pickle
 
 import numpy as np
 
 from .. import utils
+from ..cfd_fetcher import WingDetails
+from ..glide_store import GlideStore
+from ..timings import Timings
+from ..wing_stats import FlightSums, WingAccumulators
 
 
-def main(workdir):
-    with open(utils.get_flight_json_file(workdir), "r") as f:
-        flights = json.load(f)
-    wings_to_flight = {}
-    total_flights_to_analyse = 0
-    print("Reindexing")
-    for flight_id, flight in flights.items():
-        if flight is None:
-            continue
-        if not os.path.isfile(
-            utils.get_json_file_path_from_igc(workdir, flight["gps"])
-        ):
-            continue
-        wing_id = int(flight["wing"])
-        if wing_id in wings_to_flight:
-            wings_to_flight[wing_id].append(flight_id)
-        else:
-            wings_to_flight[wing_id] = [flight_id]
-        total_flights_to_analyse += 1
+def get_wings_of_classes(wing_ids, classes):
+    wd = WingDetails()
+    wd.prefetch(wing_ids)
+    wings = [wid for wid in wing_ids if wd.get_wing_details(wid)[1] in classes]
+    wd.close()
+    return wings
 
-    wings_perf = {}
-    print(
-        f"Calculating average and standart deviation on {total_flights_to_analyse} flights"
-    )
-    no_iter = 0
-    for wing_id in wings_to_flight:
-        wings_perf[wing_id] = {}
-        sum_av = 0
-        sum_sq = 0
-        weight = 0
-        nb_sample = 0
-        for flight_id in wings_to_flight[wing_id]:
-            with open(
-                utils.get_json_file_path_from_igc(workdir, flights[flight_id]["gps"]),
-                "r",
-            ) as f:
-                flight_data = json.load(f)
-            ga = np.array(flight_data["glide_angles"])
-            sampling = flight_data["sampling"]
-            sum_av += np.sum(ga) * sampling
-            sum_sq += np.sum(ga**2) * sampling
-            weight += sampling * len(ga)
-            nb_sample += len(ga)
-            if no_iter % 10000 == 0:
-                print(f"{round(no_iter/total_flights_to_analyse*100,1)} %")
-            no_iter += 1
 
-        mean = sum_av / weight
-        std_deviation = ((sum_sq / weight) - (mean) ** 2) ** (1 / 2)
-        confidence_95 = (
-            2 * std_deviation / nb_sample ** (1 / 2)
-        )  # https://fr.wikipedia.org/wiki/Intervalle_de_confiance#Estimation_d'une_moyenne
-        wings_perf[wing_id]["mean"] = mean
-        wings_perf[wing_id]["dev_hist"] = std_deviation
-        wings_perf[wing_id]["confidence"] = confidence_95
+def main(
+    workdir,
+    since=None,
+    until=None,
+    classes=None,
+    min_samples=0,
+    full=False,
+    shards=None,
+):
+    timings = Timings()
+    store = GlideStore(utils.get_glide_store_dir(workdir))
+    if since is None and until is None and classes is None:
+        # no selection, the statistics of the whole store are updated
+        # with the flights analysed since the previous run
+        acc_file = utils.get_accumulator_file(workdir)
+        acc = WingAccumulators()
+        if not full and os.path.isfile(acc_file):
+            with timings.measure("load accumulators"):
+                acc = WingAccumulators.load(acc_file)
+        nb_folded = acc.nb_records if acc.store_id == store.get_store_id() else 0
+        nb_new = store.read_raw_index().shape[0] - nb_folded
+        print(f"Merging {nb_new} new records")
+        timings.count("merged records", int(nb_new))
+        with timings.measure("fold store"):
+            acc = acc.fold_store(store)
+        with timings.measure("save accumulators"):
+            acc.save(acc_file)
+    else:
+        print("Reindexing")
+        with timings.measure("reindex"):
+            flights = FlightSums.from_store(store)
+        wing_ids = None
+        if classes is not None:
+            with timings.measure("wing classes"):
+                wing_ids = get_wings_of_classes(np.unique(flights.wing_id), classes)
+        mask = flights.select(since=since, until=until, wing_ids=wing_ids)
+        print(f"Calculating average and standart deviation on {np.sum(mask)} flights")
+        timings.count("selected flights", int(np.sum(mask)))
+        with timings.measure("aggregate"):
+            acc = WingAccumulators.from_flight_sums(flights, mask)
+
+    with timings.measure("merge shards"):
+        for shard in shards or []:
+            acc = acc.merge(WingAccumulators.load(shard))
+    with timings.measure("wing stats"):
+        wings_perf = acc.to_wings_perf(min_samples)
 
     print("Saving results")
-    with open(utils.get_stat_file(workdir), "wb") as f:
-        pickle.dump(wings_perf, f)
+    with timings.measure("save results"):
+        with open(utils.get_stat_file(workdir), "wb") as f:
+            pickle.dump(wings_perf, f)
+    timings.print_summary()
+    timings.save(utils.get_timings_file(workdir, "step2"))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("workdir", type=str, help="Work directory")
+    parser.add_argument(
+        "--since",
+        type=dt.date.fromisoformat,
+        default=None,
+        help="Only use the flights from this day on (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--until",
+        type=dt.date.fromisoformat,
+        default=None,
+        help="Only use the flights until this day included (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--classes",
+        nargs="+",
+        default=None,
+        help="Only use the wings of these classes (e.g. A B C)",
+    )
+    parser.add_argument(
+        "--min-samples",
+        type=int,
+        default=0,
+        help="Discard the wings with less glide samples than this",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Recompute the statistics from scratch instead of merging the new flights",
+    )
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        default=[],
+        help="Accumulator files of other work directories to merge in the results",
+    )
     args = parser.parse_args()
 
     workdir = os.path.abspath(args.workdir)
 
-    if not os.path.isfile(utils.get_flight_json_file(workdir)):
+    if not os.path.isdir(utils.get_glide_store_dir(workdir)):
         print("The working directory is not correct.")
+        exit(1)
 
-    main(workdir)
+    main(
+        workdir,
+        args.since,
+        args.until,
+        args.classes,
+        args.min_samples,
+        args.full,
+        args.merge,
+    )
@@ -19,7 +19,7 @@ def main(infile):
         wings = pickle.load(f)
 
     wd = WingDetails()
-    wd.load_cache()
+    wd.prefetch(int(wid) for wid in wings)
     data = []
     nbw = len(wings)
     classes = set()
@@ -66,7 +66,7 @@ def main(infile):
                 ),  # 5, lower error
             )
         )
-    wd.write_cache()
+    wd.close()
     data.sort(key=lambda x: x[3])
 
     data = np.array(data)
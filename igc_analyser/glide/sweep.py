@@ -0,0 +1,152 @@
+"""
+Computes the per wing statistics of step 2 for a grid of
+TrackAnalyser tuning parameters, analysing each track only once
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing as mp
+import os
+import pickle
+import traceback
+
+import numpy as np
+
+from .. import geodesy, utils
+from ..flight_index import STATUS_DONE, open_flight_index
+from ..igc_analyser import TrackAnalyser
+from ..sweep import make_grid, sweep_file
+from ..wing_stats import FlightSums, WingAccumulators
+
+
+def sweep_flight(job, grid, use_cache=False):
+    """
+    returns the job, the result of sweep_file and the traceback of the
+    exception it raised if any (the result is then None)
+    """
+    flight_id, wing_id, path = job
+    result, error = None, None
+    try:
+        result = sweep_file(path, grid, use_cache)
+    except Exception:
+        error = traceback.format_exc()
+    return job, result, error
+
+
+def main(
+    igc_indir, index, outfile, grid, njobs=None, use_cache=False, errors_file=None
+):
+    # the sanity of a track does not depend on the parameters, only the
+    # flights analysed by step 1 and found sane are swept
+    jobs = [
+        (flight["flight_id"], flight["wing_id"], os.path.join(igc_indir, flight["gps"]))
+        for flight in index.with_status(STATUS_DONE)
+    ]
+    nb_left_out = len(index.pending())
+    if nb_left_out > 0:
+        print(f"{nb_left_out} flights not analysed or failed in step 1 are left out")
+    print(f"Sweeping {len(grid)} parameter sets over {len(jobs)} flights")
+
+    rows = []
+    errors = []
+    with mp.Pool(njobs) as p:
+        rs = p.imap_unordered(
+            functools.partial(sweep_flight, grid=grid, use_cache=use_cache),
+            jobs,
+            chunksize=16,
+        )
+        for no_done, (job, result, error) in enumerate(rs, 1):
+            flight_id, wing_id, path = job
+            if error is not None:
+                errors.append(
+                    {"flight_id": flight_id, "path": path, "traceback": error}
+                )
+            elif result is not None:
+                rows.append((flight_id, wing_id, *result))
+            if no_done % 1000 == 0:
+                print(f"{round(no_done/len(jobs)*100,1)} %")
+    if len(errors) > 0:
+        print(f"{len(errors)} flights could not be swept, they are left out")
+    if errors_file is not None:
+        with open(errors_file, "w") as f:
+            json.dump(errors, f, indent=2)
+    if len(rows) == 0:
+        print("No sane flight to sweep over")
+        return
+
+    flight_id, wing_id, nb_sample, sums, sums_sq, sampling, date = (
+        np.array(column) for column in zip(*rows)
+    )
+    results = []
+    for i, params in enumerate(grid):
+        flights = FlightSums.from_arrays(
+            flight_id,
+            wing_id,
+            date,
+            sampling,
+            nb_sample[:, i],
+            sums[:, i],
+            sums_sq[:, i],
+        )
+        results.append(
+            (params, WingAccumulators.from_flight_sums(flights).to_wings_perf())
+        )
+
+    print("Saving results")
+    with open(outfile, "wb") as f:
+        pickle.dump(results, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workdir", type=str, help="Work directory")
+    numeric_params = [p for p in TrackAnalyser.PARAMS if p != "geodesy_mode"]
+    for name in numeric_params:
+        parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            type=float,
+            nargs="+",
+            default=None,
+            help=f"Values of {name} to sweep. Default: the TrackAnalyser default",
+        )
+    parser.add_argument(
+        "--geodesy",
+        choices=geodesy.MODES,
+        nargs="+",
+        default=None,
+        help="Geodesy modes to sweep. Default: the TrackAnalyser default",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Parallel jobs number. Default: Number of cores",
+    )
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir)
+    igc_indir = os.path.join(workdir, "igcfiles")
+
+    if not os.path.exists(igc_indir):
+        print("The input directory is invalid. Exiting.")
+        exit(1)
+
+    values = {
+        name: getattr(args, name)
+        for name in numeric_params
+        if getattr(args, name) is not None
+    }
+    if args.geodesy is not None:
+        values["geodesy_mode"] = args.geodesy
+    grid = make_grid(**values)
+    with open_flight_index(workdir) as index:
+        main(
+            igc_indir,
+            index,
+            utils.get_sweep_stat_file(workdir),
+            grid,
+            args.jobs,
+            errors_file=utils.get_errors_file(workdir, "sweep"),
+        )
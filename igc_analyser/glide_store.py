@@ -0,0 +1,142 @@
+"""
+Single columnar store for the glide angles of all the flights.
+
+The filtered glide angles of every flight are appended to one flat float32
+file, and an index file holds one fixed-size record per flight pointing to
+its slice of the values.
+"""
+
+import os
+import uuid
+
+import numpy as np
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("flight_id", "<i8"),
+        ("wing_id", "<i8"),
+        ("offset", "<i8"),
+        ("length", "<i8"),
+        ("sampling", "<f8"),
+        ("date", "<i4"),  # proleptic gregorian ordinal of the flight day
+    ]
+)
+VALUES_DTYPE = np.dtype("<f4")
+
+
+class GlideStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.values_file = os.path.join(store_dir, "glide_angles.f32")
+        self.index_file = os.path.join(store_dir, "glide_index.bin")
+        self.id_file = os.path.join(store_dir, "store_id")
+        self._values = None
+        self._index = None
+        if not os.path.isdir(self.store_dir):
+            os.makedirs(self.store_dir)
+
+    def clear(self):
+        for path in (self.values_file, self.index_file, self.id_file):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def get_store_id(self):
+        """
+        returns a random id generated when the store is created,
+        so that derived data can detect that the store has been cleared
+        """
+        if not os.path.isfile(self.id_file):
+            with open(self.id_file, "w") as f:
+                f.write(uuid.uuid4().hex)
+        with open(self.id_file, "r") as f:
+            return f.read().strip()
+
+    def open_writer(self):
+        return GlideStoreWriter(self)
+
+    def read_index(self):
+        """
+        returns the index records, keeping only the last record of a flight
+        that has been appended several times
+        flights whose last record is empty are left out, which allows
+        to discard a flight previously appended
+        """
+        index = last_records(self.read_raw_index())
+        return index[index["length"] > 0]
+
+    def read_raw_index(self):
+        """
+        returns all the index records, in the order they have been appended
+        """
+        if not os.path.isfile(self.index_file):
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.fromfile(self.index_file, dtype=INDEX_DTYPE)
+
+    def read_values(self):
+        """
+        memory maps the flat array of glide angles
+        """
+        if not os.path.isfile(self.values_file) or (
+            os.path.getsize(self.values_file) == 0
+        ):
+            return np.zeros(0, dtype=VALUES_DTYPE)
+        return np.memmap(self.values_file, dtype=VALUES_DTYPE, mode="r")
+
+    def load(self):
+        self._index = self.read_index()
+        self._values = self.read_values()
+        return self._index, self._values
+
+    def get_glide_angles(self, record):
+        if self._values is None:
+            self.load()
+        return self._values[record["offset"] : record["offset"] + record["length"]]
+
+
+def last_records(index):
+    """
+    keeps only the last record of each flight of an index
+    """
+    _, last = np.unique(index["flight_id"][::-1], return_index=True)
+    return index[np.sort(index.shape[0] - 1 - last)]
+
+
+class GlideStoreWriter:
+    """
+    appends flights to a GlideStore, to be used as a context manager
+    """
+
+    def __init__(self, store):
+        self.store = store
+        store.get_store_id()
+        self.values_f = open(store.values_file, "ab")
+        self.index_f = open(store.index_file, "ab")
+        self.offset = self.values_f.tell() // VALUES_DTYPE.itemsize
+
+    def append(self, flight_id, wing_id, glide_angles, sampling, date):
+        """
+        returns the offset of the glide angles in the store
+        """
+        glide_angles = np.asarray(glide_angles, dtype=VALUES_DTYPE)
+        record = np.array(
+            [(flight_id, wing_id, self.offset, glide_angles.shape[0], sampling, date)],
+            dtype=INDEX_DTYPE,
+        )
+        # the values are written first so that an index record
+        # never points to missing data
+        glide_angles.tofile(self.values_f)
+        self.values_f.flush()
+        record.tofile(self.index_f)
+        offset = self.offset
+        self.offset += glide_angles.shape[0]
+        return offset
+
+    def close(self):
+        self.values_f.close()
+        self.index_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,14 +1,151 @@
+import inspect
 import math
 
 import matplotlib.pyplot as plt
 import numpy as np
-from haversine import haversine
 
+from . import geodesy
 from .igc_reader import IGCReader
 from .utils import *
+from .windows import Windows, prefix_sums
+
+# bounds of the mean sampling and minimum altitude range of a sane track
+MAX_TIME_DELTA = 6
+MIN_TIME_DELTA = 0.001
+MIN_ALTITUDE_RANGE = 10
+
+SEGMENT_DTYPE = np.dtype(
+    [
+        ("start_index", "<i8"),
+        ("end_index", "<i8"),
+        ("start", "<f8"),
+        ("end", "<f8"),
+        ("duration", "<f8"),
+        ("glide_angle_mean", "<f8"),
+        ("distance", "<f8"),
+    ]
+)
+
+
+def mask_runs(mask):
+    """
+    returns the start and end (excluded) indexes of the runs of 1 of a mask
+    """
+    edges = np.diff(np.concatenate(([0], mask, [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def planar_heading(lat, lon):
+    """
+    heading of the steps from the raw latitude and longitude differences,
+    as if they were on the same scale, as computed before the geodesy modes
+    only kept to measure its error in bench.py
+    """
+    diff_lat = np.diff(lat)
+    diff_lon = np.diff(lon)
+    heading = np.zeros_like(diff_lat)
+    np.divide(diff_lon, diff_lat, out=heading, where=diff_lat != 0)
+    heading = np.arctan(heading) / np.pi * 180
+    heading[diff_lon < 0] += 180
+    heading[heading < 0] += 360
+    return heading
+
+
+def compute_features(
+    ts,
+    lat,
+    lon,
+    altitude,
+    frame_len_sec,
+    initial_heading=0,
+    geodesy_mode=geodesy.HAVERSINE,
+    ref_lat=None,
+):
+    """
+    computes the per step features of a track, step i going from fix i to i + 1
+    the sweeping means are taken over the steps starting at most
+    frame_len_sec before the end of the current one, truncated at the start
+    of the arrays
+    initial_heading is the heading of the step before the first fix
+    geodesy_mode is one of geodesy.MODES
+    ref_lat is the latitude of the equirectangular projection, the mean
+    latitude of the fixes if None
+    """
+    if geodesy_mode == geodesy.EQUIRECTANGULAR and ref_lat is None:
+        ref_lat = np.mean(lat)
+    ver_dist = np.diff(altitude)
+    hor_dist, heading = geodesy.distance_and_bearing(
+        lat[:-1], lon[:-1], lat[1:], lon[1:], geodesy_mode, ref_lat
+    )
+    safe_hor_dist = np.where(hor_dist == 0, 0.0000001, hor_dist)
+
+    turn = np.diff(heading, prepend=initial_heading)
+    turn = (turn + 180) % 360 - 180
+    glide_angle = np.arctan(ver_dist / safe_hor_dist) / np.pi * 180
+
+    # the window ending at step i covers the fixes lo[i] .. i + 1
+    windows = Windows.trailing(ts[:-1], ts[1:], frame_len_sec)
+    end = windows.hi
+    lo = windows.lo
+    with np.errstate(divide="ignore", invalid="ignore"):
+        window_duration = ts[end] - ts[lo]
+        glide_angle_m = windows.mean(glide_angle)
+        turn_speed = windows.sum(turn) / window_duration
+        straight_line_speed = (
+            geodesy.distance(
+                lat[end],
+                lon[end],
+                lat[lo],
+                lon[lo],
+                geodesy_mode,
+                ref_lat,
+            )
+            / window_duration
+        )
+
+    return {
+        "hor_dist": hor_dist,
+        "heading": heading,
+        "turn": turn,
+        "glide_angle": glide_angle,
+        "glide_angle_m": glide_angle_m,
+        "turn_speed": turn_speed,
+        "straight_line_speed": straight_line_speed,
+    }
+
+
+def glide_mask(
+    turn_speed,
+    straight_line_speed,
+    glide_angle_m,
+    max_turn,
+    min_speed,
+    max_glide_ratio,
+    min_glide_ratio,
+):
+    """
+    returns 1 for the steps that look like a glide, before any filtering
+    on the glide duration
+    """
+    return (
+        (np.abs(turn_speed) < max_turn).astype(int)
+        * (straight_line_speed > min_speed / 3.6).astype(int)
+        * (glide_angle_m < gr2ga(max_glide_ratio)).astype(int)
+        * (glide_angle_m > gr2ga(min_glide_ratio)).astype(int)
+    )
 
 
 class TrackAnalyser:
+    PARAMS = (
+        "frame_len_sec",
+        "max_turn",
+        "min_speed",
+        "min_sec",
+        "max_glide_ratio",
+        "min_glide_ratio",
+        "geodesy_mode",
+    )
+
     def __init__(
         self,
         filename,
@@ -18,7 +155,15 @@ class TrackAnalyser:
         min_sec=20,
         max_glide_ratio=15,
         min_glide_ratio=2,
+        geodesy_mode=geodesy.HAVERSINE,
+        use_cache=False,
+        raw=None,
     ):
+        """
+        geodesy_mode is the one of the distances and headings, see
+        compute_features, raw the content of the file if already read
+        """
+        geodesy.check_mode(geodesy_mode)
         self.filename = filename
         self.frame_len_sec = frame_len_sec
         self.max_turn = max_turn
@@ -26,9 +171,37 @@ class TrackAnalyser:
         self.min_sec = min_sec
         self.max_glide_ratio = max_glide_ratio
         self.min_glide_ratio = min_glide_ratio
-        self.track = IGCReader(filename)
+        self.geodesy_mode = geodesy_mode
+        self.track = IGCReader(filename, use_cache=use_cache, raw=raw)
         self.track_mean_time_delta = self.track.mean_time_delta()
 
+    @classmethod
+    def resolve_params(cls, **params):
+        """
+        returns the full set of tuning parameters, defaults included
+        """
+        signature = inspect.signature(cls.__init__).parameters
+        return {name: params.get(name, signature[name].default) for name in cls.PARAMS}
+
+    def check_time_sanity(self):
+        """
+        returns the sanity code of the timestamps alone, computed once as
+        it does not depend on the altitude source
+        """
+        if not hasattr(self, "_time_sanity"):
+            if (
+                self.track_mean_time_delta > MAX_TIME_DELTA
+                or self.track_mean_time_delta < MIN_TIME_DELTA
+            ):
+                # Bad time deltas, to high or (abnormally) negative or low
+                self._time_sanity = 1
+            elif np.min(np.diff(self.track.timestamp)) < 0:
+                # the diff between consecutive time deltas must always be positive
+                self._time_sanity = 2
+            else:
+                self._time_sanity = 0
+        return self._time_sanity
+
     def check_track_sanity(self, use_baro=True):
         """
         checks track sanity
@@ -36,156 +209,97 @@ class TrackAnalyser:
         returns another code depending on the reason of the insaninty
         """
         altitude = self.track.altitude_baro if use_baro else self.track.altitude_gnss
-        if self.track_mean_time_delta > 6 or self.track_mean_time_delta < 0.001:
-            # Bad time deltas, to high or (abnormally) negative or low
-            return 1
-        if np.min(np.diff(self.track.timestamp)) < 0:
-            # the diff between consecutive time deltas must always be positive
-            return 2
-        if np.max(altitude) - np.min(altitude) < 10:
+        time_sanity = self.check_time_sanity()
+        if time_sanity != 0:
+            return time_sanity
+        if np.max(altitude) - np.min(altitude) < MIN_ALTITUDE_RANGE:
             # no meaningful altitude data
             return 3
         return 0
 
+    def select_altitude_source(self):
+        """
+        finds wether baro can be used or not and if we can default to gnss altitude
+        returns use_baro and the sanity code of the track with this altitude
+        """
+        for use_baro in (True, False):
+            sanity = self.check_track_sanity(use_baro=use_baro)
+            if sanity == 0:
+                break
+        return use_baro, sanity
+
     def process(self, use_baro=True):
-        frame_len = round(self.frame_len_sec / self.track_mean_time_delta)
         altitude = self.track.altitude_baro if use_baro else self.track.altitude_gnss
-        glide_angle = []
-        glide_angle_m = [0]  # sweeping mean
-        turn = []
-        cum_turn = [0]
-        cur_heading = 0
-        straight_line_speed = []
-        timestamps = []
-        cum_distance = [0]
-        self.heading = []
-        for i in range(len(self.track.timestamp) - 1):
-            diff_lat = self.track.latitude[i + 1] - self.track.latitude[i]
-            diff_lon = self.track.longitude[i + 1] - self.track.longitude[i]
-            ver_dist = altitude[i + 1] - altitude[i]
-            hor_dist = (
-                haversine(
-                    (self.track.latitude[i], self.track.longitude[i]),
-                    (self.track.latitude[i + 1], self.track.longitude[i + 1]),
-                )
-                * 1000
-            )
+        ts = self.track.timestamp
+        features = compute_features(
+            ts,
+            self.track.latitude,
+            self.track.longitude,
+            altitude,
+            self.frame_len_sec,
+            geodesy_mode=self.geodesy_mode,
+        )
 
-            cum_distance.append(cum_distance[-1] + hor_dist)
-
-            if hor_dist == 0:
-                hor_dist = 0.0000001
-
-            prev_heading = cur_heading
-            cur_heading = 0
-            if diff_lat != 0:
-                cur_heading = math.atan(diff_lon / diff_lat) / math.pi * 180
-            if diff_lon < 0:
-                cur_heading += 180
-            if cur_heading < 0:
-                cur_heading += 360
-
-            self.heading.append(cur_heading)
-
-            timestamps.append(self.track.timestamp[i + 1] - self.track.timestamp[0])
-            current_turn = cur_heading - prev_heading
-            current_turn = (current_turn + 180) % 360 - 180
-            turn.append(current_turn)
-            glide_angle.append(math.atan(ver_dist / hor_dist) / math.pi * 180)
-
-            if i >= frame_len:
-                glide_angle_m.append(
-                    glide_angle_m[-1]
-                    + (glide_angle[-1] - glide_angle[-frame_len - 1]) / frame_len
-                )
-                cum_turn.append(
-                    (
-                        cum_turn[-1]
-                        * (
-                            self.track.timestamp[i]
-                            - self.track.timestamp[i - frame_len]
-                        )
-                        + turn[-1]
-                        - turn[-frame_len - 1]
-                    )
-                    / (
-                        self.track.timestamp[i + 1]
-                        - self.track.timestamp[i + 1 - frame_len]
-                    )
-                )
-                straight_line_speed.append(
-                    haversine(
-                        (self.track.latitude[i + 1], self.track.longitude[i + 1]),
-                        (
-                            self.track.latitude[i + 1 - frame_len],
-                            self.track.longitude[i + 1 - frame_len],
-                        ),
-                    )
-                    * 1000
-                    / (
-                        self.track.timestamp[i + 1]
-                        - self.track.timestamp[i + 1 - frame_len]
-                    )
-                )
-            else:
-                glide_angle_m.append(
-                    (glide_angle_m[-1] * (len(glide_angle) - 1) + glide_angle[-1])
-                    / len(glide_angle)
-                )
-                cum_turn.append(
-                    (
-                        cum_turn[-1]
-                        * (self.track.timestamp[i] - self.track.timestamp[0])
-                        + turn[-1]
-                    )
-                    / (self.track.timestamp[i + 1] - self.track.timestamp[0])
-                )
-                straight_line_speed.append(
-                    haversine(
-                        (self.track.latitude[i + 1], self.track.longitude[i + 1]),
-                        (self.track.latitude[0], self.track.longitude[0]),
-                    )
-                    * 1000
-                    / (self.track.timestamp[i + 1] - self.track.timestamp[0])
-                )
-
-        self.timestamps = np.array(timestamps)
-        self.glide_angles_instantaneous = np.array(glide_angle)
-        self.glide_angles = np.array(glide_angle_m[1:])
-        self.turn_speeds = np.array(cum_turn[1:])
-        self.turn_speeds_instantaneous = np.array(turn)
-        self.straight_line_speeds = np.array(straight_line_speed)
-        self.cumulative_distance = np.array(cum_distance)
+        self.heading = features["heading"]
+        self.timestamps = ts[1:] - ts[0]
+        self.glide_angles_instantaneous = features["glide_angle"]
+        self.glide_angles = features["glide_angle_m"]
+        self.turn_speeds = features["turn_speed"]
+        self.turn_speeds_instantaneous = features["turn"]
+        self.straight_line_speeds = features["straight_line_speed"]
+        self.cumulative_distance = prefix_sums(features["hor_dist"])
 
     def calc_glide_mask(self):
         min_iter = round(self.min_sec / self.track_mean_time_delta)
 
-        mask = (
-            (np.abs(self.turn_speeds) < self.max_turn).astype(int)
-            * (self.straight_line_speeds > self.min_speed / 3.6).astype(int)
-            * (self.glide_angles < gr2ga(self.max_glide_ratio)).astype(int)
-            * (self.glide_angles > gr2ga(self.min_glide_ratio)).astype(int)
+        mask = glide_mask(
+            self.turn_speeds,
+            self.straight_line_speeds,
+            self.glide_angles,
+            self.max_turn,
+            self.min_speed,
+            self.max_glide_ratio,
+            self.min_glide_ratio,
         )
 
-        mask_filtered = []
-        current_on_begin = None
-        for i, elt in enumerate(mask):
-            if elt == 1 and current_on_begin is None:
-                current_on_begin = i
-            if (elt == 0 or i + 1 == len(mask)) and current_on_begin is not None:
-                len_mask_on = i - current_on_begin
-                if i + 1 == len(mask):
-                    len_mask_on += 1
-                if len_mask_on > min_iter:
-                    mask_filtered += [1] * len_mask_on
-                else:
-                    mask_filtered += [0] * len_mask_on
-                current_on_begin = None
-            if elt == 0:
-                mask_filtered.append(0)
+        starts, ends = mask_runs(mask)
+        keep = ends - starts > min_iter
+        starts, ends = starts[keep], ends[keep]
+
+        # the kept runs are turned back into a mask by marking their edges
+        edges = np.zeros(mask.shape[0] + 1, dtype=int)
+        np.add.at(edges, starts, 1)
+        np.add.at(edges, ends, -1)
 
         self._unfiltered_glide_mask = mask
-        self.glide_mask = mask_filtered
+        self.glide_mask = np.cumsum(edges[:-1])
+        self.glide_segments = self._segment_table(starts, ends)
+
+    def _segment_table(self, starts, ends):
+        """
+        steps starts[k] .. ends[k] - 1 go from fix starts[k] to fix ends[k]
+        """
+        ts = self.track.timestamp - self.track.timestamp[0]
+        cum_glide_angle = prefix_sums(self.glide_angles)
+        segments = np.zeros(starts.shape[0], dtype=SEGMENT_DTYPE)
+        segments["start_index"] = starts
+        segments["end_index"] = ends
+        segments["start"] = ts[starts]
+        segments["end"] = ts[ends]
+        segments["duration"] = ts[ends] - ts[starts]
+        segments["glide_angle_mean"] = (
+            cum_glide_angle[ends] - cum_glide_angle[starts]
+        ) / (ends - starts)
+        segments["distance"] = (
+            self.cumulative_distance[ends] - self.cumulative_distance[starts]
+        )
+        return segments
+
+    def get_glide_samples(self):
+        """
+        returns the sweeping mean glide angles of the steps within a glide
+        """
+        return self.glide_angles[self.glide_mask == 1]
 
     def get_clockwise_thermalling_ratio(self):
         mask_cw = (self.turn_speeds < -self.max_turn).astype(int) * (
@@ -201,12 +315,8 @@ class TrackAnalyser:
         ), self.track_mean_time_delta * (sum(mask_cw) + sum(mask_ccw))
 
     def get_glide_ratio(self):
-        ga_filt = [
-            val
-            for pos, val in enumerate(self.glide_angles)
-            if self.glide_mask[pos] == 1
-        ]
-        gr = -1 / math.tan(sum(ga_filt) / len(ga_filt) / 180 * math.pi)
+        ga_filt = self.get_glide_samples()
+        gr = -1 / math.tan(np.mean(ga_filt) / 180 * math.pi)
         return gr
 
     def plot_glide_mask_debug(self):
@@ -263,11 +373,7 @@ class TrackAnalyser:
 
     def plot_glide_ratio_histogram(self):
         counts, bins = np.histogram(
-            [
-                ga2gr(ga)
-                for pos, ga in enumerate(self.glide_angles)
-                if self.glide_mask[pos] == 1
-            ],
+            [ga2gr(ga) for ga in self.get_glide_samples()],
             50,
             [-15, 15],
         )
@@ -0,0 +1,285 @@
+"""
+Per batch archives of igc files, instead of one text file per track
+
+The tracks of a batch are appended to igcfiles/<batch_no>.igcz as
+independent gzip members (the archive itself being a valid gzip file of
+all its tracks), and their offsets to igcfiles/<batch_no>.igcz.idx, one
+json per line, the last line of a track winning. A track is read by a seek
+and the decompression of its own member only.
+
+A track of an archive is addressed as <batch_no>.igcz/<name> wherever the
+path of an igc file is expected: relative paths of the flight index,
+IGCReader, the manifest...
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import mmap
+import os
+import threading
+
+from . import utils
+
+ARCHIVE_SUFFIX = ".igcz"
+INDEX_SUFFIX = ".idx"
+
+
+def split_member_path(path):
+    """
+    returns the archive and the name of a track within an archive,
+    None for a plain igc file
+    """
+    archive, sep, name = path.rpartition(ARCHIVE_SUFFIX + os.sep)
+    if sep == "":
+        return None
+    return archive + ARCHIVE_SUFFIX, name
+
+
+class IGCArchive:
+    """
+    the tracks are only appended by one process at a time (by any of its
+    threads), the readers picking up the tracks appended since they opened
+    the archive
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.entries = {}
+        # index lines which could not be decoded, e.g. cut by an interruption
+        self.nb_corrupted = 0
+        self._index_offset = 0
+        self._f = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        reads the index lines appended since the last refresh
+        """
+        if not os.path.isfile(self.index_path):
+            return
+        self._check_process()
+        with self._lock, open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # line still being written
+                    break
+                self._index_offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # cut by an interruption, then ended by the next add
+                    self.nb_corrupted += 1
+                    continue
+                self.entries[entry["name"]] = entry
+
+    def __contains__(self, name):
+        if name not in self.entries:
+            self.refresh()
+        return name in self.entries
+
+    def stat(self, name):
+        """
+        returns the index entry of a track: name, offset and length of its
+        member, size of the track
+        """
+        if name not in self:
+            raise FileNotFoundError(f"No track {name} in {self.path}")
+        return self.entries[name]
+
+    def add(self, name, data, compresslevel=6):
+        """
+        appends a track, replacing the previous one of the same name
+        """
+        member = gzip.compress(data, compresslevel=compresslevel, mtime=0)
+        self._check_process()
+        with self._lock:
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(member)
+            # the member is complete before the index points to it
+            entry = {"name": name, "offset": offset, "length": len(member)}
+            entry["size"] = len(data)
+            line = json.dumps(entry) + "\n"
+            with open(self.index_path, "ab+") as f:
+                # a line cut by an interruption must not run into this one
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = "\n" + line
+                f.write(line.encode())
+            self.entries[name] = entry
+
+    def read(self, name):
+        entry = self.stat(name)
+        self._check_process()
+        with self._lock:
+            if self._f is None:
+                self._f = open(self.path, "rb")
+            self._f.seek(entry["offset"])
+            member = self._f.read(entry["length"])
+        return gzip.decompress(member)
+
+    def _check_process(self):
+        """
+        a forked process must not share the file offset of its parent, nor
+        its lock which may have been held by another thread
+        """
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._f = None
+            self._pid = os.getpid()
+
+    def close(self):
+        if self._f is not None and self._pid == os.getpid():
+            self._f.close()
+        self._f = None
+        self._pid = None
+
+
+# archives opened by this process, kept open for the next tracks
+_archives = {}
+
+
+def open_archive(path):
+    if path not in _archives:
+        _archives[path] = IGCArchive(path)
+    return _archives[path]
+
+
+def open_track(path):
+    """
+    returns a binary file object of an igc file or of an archived track
+    """
+    member = split_member_path(path)
+    if member is None:
+        return open(path, "rb")
+    archive, name = member
+    return io.BytesIO(open_archive(archive).read(name))
+
+
+@contextlib.contextmanager
+def map_track(path):
+    """
+    yields the content of an igc file, memory-mapped (bytes for an empty
+    file or an archived track), for all the readers of a track to share a
+    single read of it
+    """
+    member = split_member_path(path)
+    if member is not None:
+        archive, name = member
+        yield open_archive(archive).read(name)
+        return
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield mapped
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # still exported to the arrays of an exception traceback,
+            # unmapped along with them
+            pass
+
+
+def track_stat(path):
+    """
+    returns the size and modification time of an igc file, None if it does
+    not exist
+    an archived track is never modified, only appended again: the offset
+    of its member stands for its modification time
+    """
+    member = split_member_path(path)
+    if member is None:
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    archive, name = member
+    archive = open_archive(archive)
+    if name not in archive:
+        return None
+    entry = archive.stat(name)
+    return entry["size"], entry["offset"]
+
+
+def pack_workdir(workdir, remove=False):
+    """
+    moves the igc files of the batch directories of a work directory into
+    their archives, renaming them in the flight index and in the manifest
+    so that their analyses stay valid
+    returns the number of tracks archived, their size as igc files and
+    the size of the archives
+    """
+    # imported here, both of them importing this module
+    from .flight_index import open_flight_index
+    from .manifest import AnalysisManifest
+
+    igc_indir = os.path.join(workdir, "igcfiles")
+    manifest = AnalysisManifest(utils.get_manifest_file(workdir), igc_indir)
+    manifest.load()
+    packed = []
+    archives = set()
+    with open_flight_index(workdir) as index:
+        for flight in index.all():
+            path = os.path.join(igc_indir, flight["gps"])
+            if split_member_path(path) is not None or not os.path.isfile(path):
+                continue
+            batch, name = os.path.split(flight["gps"])
+            archive = open_archive(utils.get_track_archive_file(workdir, batch))
+            with open(path, "rb") as f:
+                archive.add(name, f.read())
+            gps = os.path.join(batch + ARCHIVE_SUFFIX, name)
+            index.rename_track(flight["flight_id"], gps)
+            manifest.rename(flight["flight_id"], gps)
+            packed.append(path)
+            archives.add(archive)
+    # the index and the manifest point to the archives before any removal
+    manifest.save()
+
+    plain_size = sum(os.path.getsize(path) for path in packed)
+    archive_size = sum(
+        os.path.getsize(archive.path) + os.path.getsize(archive.index_path)
+        for archive in archives
+    )
+    if remove:
+        for path in packed:
+            os.remove(path)
+            # the caches of the archived tracks are not used anymore
+            cachefile = utils.get_track_cache_path(path)
+            if os.path.isfile(cachefile):
+                os.remove(cachefile)
+        for batch_dir in {os.path.dirname(path) for path in packed}:
+            if len(os.listdir(batch_dir)) == 0:
+                os.rmdir(batch_dir)
+    return len(packed), plain_size, archive_size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workdir", type=str, help="Work directory to pack")
+    parser.add_argument(
+        "--remove",
+        action="store_true",
+        help="Remove the igc files and their caches once archived",
+    )
+    args = parser.parse_args()
+
+    nb_packed, plain_size, archive_size = pack_workdir(
+        os.path.abspath(args.workdir), args.remove
+    )
+    print(f"{nb_packed} tracks archived")
+    if nb_packed > 0:
+        print(
+            f"{plain_size / 1e6:.1f} MB of igc files, "
+            f"{archive_size / 1e6:.1f} MB of archives"
+        )
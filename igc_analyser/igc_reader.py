@@ -1,25 +1,132 @@
 import datetime as dt
+import io
+import os
+import time
 
 import matplotlib.pyplot as plt
 import numpy as np
 from mpl_toolkits.mplot3d import axes3d
 
+from . import utils
+from .igc_archive import open_track, split_member_path
+
+# byte offsets of the fixed-width fields of a B record
+B_RECORD_LEN = 35
+B_FIELDS = {
+    "hour": (1, 3),
+    "minute": (3, 5),
+    "second": (5, 7),
+    "lat_deg": (7, 9),
+    "lat_min": (9, 14),
+    "lon_deg": (15, 18),
+    "lon_min": (18, 23),
+    "gnss_alt": (25, 30),
+    "baro_alt": (30, 35),
+}
+# to be bumped whenever the decoded arrays or the cache layout change
+TRACK_CACHE_VERSION = 2
+# resolution of the cached coordinates, the one of the igc files
+COORD_UNITS_PER_DEG = 60 * 1000
+
 
 class IGCReader:
-    def __init__(self, filename):
+    def __init__(self, filename, bulk=True, use_cache=False, raw=None):
+        """
+        raw is the content of the file if already read, see map_track
+        """
         self.filename = filename
         self.date = None
         self.data_formated = []
-        with open(filename, "r") as f:
-            for rec in f.readlines():
-                self.read_record(rec)
-        self.data_formated = np.array(self.data_formated)
+        # the archived tracks have no cache next to them
+        use_cache = use_cache and split_member_path(filename) is None
+        if not (use_cache and self.load_cache()):
+            if bulk:
+                self.read_bulk(raw)
+            else:
+                with io.TextIOWrapper(open_track(filename)) as f:
+                    for rec in f.readlines():
+                        self.read_record(rec)
+                self.data_formated = np.array(self.data_formated)
+            if use_cache:
+                self.write_cache()
         self.timestamp = self.data_formated[:, 0]
         self.latitude = self.data_formated[:, 1]
         self.longitude = self.data_formated[:, 2]
         self.altitude_gnss = self.data_formated[:, 3]
         self.altitude_baro = self.data_formated[:, 4]
 
+    def _source_key(self):
+        stat = os.stat(self.filename)
+        return np.array(
+            [TRACK_CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64
+        )
+
+    def load_cache(self):
+        """
+        loads the decoded arrays from the binary cache next to the igc file
+        returns False if there is no cache or if it is outdated
+        """
+        cachefile = utils.get_track_cache_path(self.filename)
+        if not os.path.isfile(cachefile):
+            return False
+        try:
+            with np.load(cachefile) as cache:
+                if not np.array_equal(cache["source"], self._source_key()):
+                    return False
+                self.data_formated = np.column_stack(
+                    (
+                        int(cache["start"]) + cache["time"].astype(np.int64),
+                        self._decode_coord(cache["lat"]),
+                        self._decode_coord(cache["lon"]),
+                        cache["gnss_alt"],
+                        cache["baro_alt"],
+                    )
+                ).astype(float)
+                self.day = dt.date.fromordinal(int(cache["day"]))
+        except (OSError, ValueError, KeyError):
+            # corrupted cache, it will be rewritten
+            return False
+        return True
+
+    def write_cache(self):
+        """
+        writes the decoded arrays as int32 columns at the resolution of the
+        igc file (seconds, meters and 1/1000 minute), about half the size of
+        the file and decoded back to the very same floats
+        """
+        cachefile = utils.get_track_cache_path(self.filename)
+        data = self.data_formated
+        start = int(data[0, 0]) if data.shape[0] > 0 else 0
+        # write then rename so that concurrent readers never see a partial file
+        tmpfile = f"{cachefile}.{os.getpid()}.tmp"
+        with open(tmpfile, "wb") as f:
+            np.savez(
+                f,
+                source=self._source_key(),
+                day=self.day.toordinal(),
+                start=start,
+                time=(data[:, 0] - start).astype(np.int32),
+                lat=self._encode_coord(data[:, 1]),
+                lon=self._encode_coord(data[:, 2]),
+                gnss_alt=data[:, 3].astype(np.int32),
+                baro_alt=data[:, 4].astype(np.int32),
+            )
+        os.replace(tmpfile, cachefile)
+
+    @staticmethod
+    def _encode_coord(coord):
+        return np.round(coord * COORD_UNITS_PER_DEG).astype(np.int32)
+
+    @staticmethod
+    def _decode_coord(units):
+        """
+        same operations as the decoding of the B records, for the cached
+        tracks to be analysed exactly like the igc files
+        """
+        units = units.astype(np.int64)
+        deg, minutes = np.divmod(np.abs(units), COORD_UNITS_PER_DEG)
+        return np.sign(units) * (deg + minutes / 1000 / 60)
+
     def read_record(self, rec):
         if rec.startswith("B"):
             self.read_b_record(rec)
@@ -45,12 +152,98 @@ class IGCReader:
         if rec[14] == "S":
             lat = -lat
         lon = int(rec[15:18]) + int(rec[18:23]) / 1000 / 60
-        if rec[23] == "0":
+        if rec[23] == "W":
             lon = -lon
         gnss_alt = int(rec[25:30])
         baro_alt = int(rec[30:35])
         self.data_formated.append((time, lat, lon, gnss_alt, baro_alt))
 
+    def read_bulk(self, raw=None):
+        """
+        decodes all the B records at once from the raw bytes of the file,
+        without building any per-line python object
+        """
+        if raw is None:
+            with open_track(self.filename) as f:
+                raw = f.read()
+        self.data_formated = self.decode_records(raw)
+        if self.data_formated.shape[0] == 0:
+            raise OSError("No B record")
+
+    def decode_records(self, raw):
+        """
+        decodes the B records of a block of complete lines,
+        reading the header records found before the first B record
+        if the day is not known yet
+        """
+        raw = np.frombuffer(raw, dtype=np.uint8)
+        line_ends = np.flatnonzero(raw == ord("\n"))
+        line_starts = np.concatenate(([0], line_ends + 1))
+        line_ends = np.append(line_ends, raw.shape[0])
+        non_empty = line_ends > line_starts
+        line_starts = line_starts[non_empty]
+        line_ends = line_ends[non_empty]
+        first_char = raw[line_starts]
+
+        b_lines = np.flatnonzero(first_char == ord("B"))
+        # the header records (only a few lines) are still read one by one,
+        # even from a block without any B record (e.g. the start of a live track)
+        if not hasattr(self, "day"):
+            header_end = b_lines[0] if b_lines.shape[0] > 0 else first_char.shape[0]
+            for i in np.flatnonzero(first_char[:header_end] == ord("H")):
+                self.read_h_record(
+                    raw[line_starts[i] : line_ends[i]]
+                    .tobytes()
+                    .decode(errors="replace")
+                )
+        if b_lines.shape[0] == 0:
+            return np.zeros((0, 5))
+        if not hasattr(self, "day"):
+            raise OSError("No date record before the first B record")
+
+        starts = line_starts[b_lines]
+        if np.any(line_ends[b_lines] - starts < B_RECORD_LEN):
+            raise OSError("Truncated record")
+        rec = raw[starts[:, None] + np.arange(B_RECORD_LEN)]
+        if not np.all(np.isin(rec[:, 14], (ord("N"), ord("S")))) or not np.all(
+            np.isin(rec[:, 23], (ord("E"), ord("W")))
+        ):
+            raise OSError("Can't decode data")
+
+        fields = {
+            name: self._decode_b_field(rec, *pos) for name, pos in B_FIELDS.items()
+        }
+        day_start = int(
+            dt.datetime(
+                year=self.day.year, month=self.day.month, day=self.day.day
+            ).timestamp()
+        )
+        time = (
+            day_start + fields["hour"] * 3600 + fields["minute"] * 60 + fields["second"]
+        )
+        lat = fields["lat_deg"] + fields["lat_min"] / 1000 / 60
+        lat[rec[:, 14] == ord("S")] *= -1
+        lon = fields["lon_deg"] + fields["lon_min"] / 1000 / 60
+        lon[rec[:, 23] == ord("W")] *= -1
+        return np.column_stack(
+            (time, lat, lon, fields["gnss_alt"], fields["baro_alt"])
+        ).astype(float)
+
+    @staticmethod
+    def _decode_b_field(rec, start, stop):
+        """
+        decodes a column of fixed-width decimal fields,
+        allowing for a leading minus sign (e.g. altitudes below sea level)
+        """
+        digits = rec[:, start:stop].astype(np.int64) - ord("0")
+        negative = rec[:, start] == ord("-")
+        digits[negative, 0] = 0
+        if np.any((digits < 0) | (digits > 9)):
+            raise OSError("Can't decode data")
+        value = digits @ (10 ** np.arange(stop - start - 1, -1, -1))
+        value[negative] *= -1
+        return value
+
     def read_h_record(self, rec):
         if rec.startswith("HFDTE"):
             if rec.startswith("HFDTEDATE"):
@@ -61,7 +254,7 @@ class IGCReader:
                 )
             except ValueError as e:
                 print(f"{e}, filling with 01/01/2000")
-            self.day = dt.date(day=1, month=1, year=2000)
+                self.day = dt.date(day=1, month=1, year=2000)
 
     def display_track(self):
         ax = plt.figure().add_subplot(projection="3d")
@@ -77,3 +270,52 @@ class IGCReader:
 
     def mean_time_delta(self):
         return np.mean(np.diff(self.timestamp))
+
+
+class IGCChunkReader(IGCReader):
+    """
+    iterates over the B records of an igc file by chunks of complete lines,
+    each chunk being decoded as IGCReader.data_formated
+    if follow, the file is tailed while it is growing (e.g. a live track),
+    polled every poll_interval seconds until it did not grow for
+    idle_timeout seconds
+    """
+
+    def __init__(
+        self,
+        filename,
+        chunk_size=1 << 20,
+        follow=False,
+        poll_interval=1,
+        idle_timeout=60,
+    ):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+
+    def __iter__(self):
+        remainder = b""
+        last_growth = time.monotonic()
+        with open_track(self.filename) as f:
+            while True:
+                block = f.read(self.chunk_size)
+                if not block:
+                    idle = time.monotonic() - last_growth
+                    if not self.follow or idle >= self.idle_timeout:
+                        break
+                    # the last line is kept in remainder until complete
+                    time.sleep(self.poll_interval)
+                    continue
+                last_growth = time.monotonic()
+                block = remainder + block
+                cut = block.rfind(b"\n") + 1
+                remainder = block[cut:]
+                data = self.decode_records(block[:cut])
+                if data.shape[0] > 0:
+                    yield data
+        # the last line of the file may not end with a newline
+        data = self.decode_records(remainder)
+        if data.shape[0] > 0:
+            yield data
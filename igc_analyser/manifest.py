@@ -0,0 +1,118 @@
+"""
+Keeps track of the igc files already analysed, so that only the new or
+changed ones (or the ones analysed with other parameters) are processed again
+"""
+
+import hashlib
+import json
+import os
+
+from .igc_archive import open_track, track_stat
+
+# version of the analysis itself, bumped when it changes the results of a
+# file analysed with the same parameters (2: time based sweeping windows,
+# which also differ on regular tracks whose sampling does not divide
+# frame_len_sec, e.g. 6 steps instead of 7 at 3 s, 3: haversine headings
+# instead of the planar ones)
+ANALYSIS_VERSION = 3
+
+
+def file_hash(path, raw=None):
+    """
+    raw is the content of the file if already read, see map_track
+    """
+    if raw is not None:
+        return hashlib.sha1(raw).hexdigest()
+    h = hashlib.sha1()
+    with open_track(path) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_signature(path, raw=None):
+    """
+    returns the stat of the file and its content hash
+    """
+    size, mtime_ns = track_stat(path)
+    return {
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "hash": file_hash(path, raw),
+    }
+
+
+class AnalysisManifest:
+    """
+    entries are keyed by flight id, the igc paths are relative to root
+    """
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.entries = {}
+
+    def load(self):
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        tmpfile = f"{self.path}.tmp"
+        with open(tmpfile, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmpfile, self.path)
+
+    def clear(self):
+        self.entries = {}
+
+    def get(self, flight_id):
+        return self.entries.get(str(flight_id))
+
+    def is_up_to_date(self, flight_id, relpath, params):
+        """
+        a flight is up to date if it has been analysed by the same version
+        with the same parameters and the file did not change since
+        the content hash is only computed if the size or mtime changed
+        """
+        entry = self.get(flight_id)
+        if (
+            entry is None
+            or entry.get("version") != ANALYSIS_VERSION
+            or entry["params"] != params
+            or entry["path"] != relpath
+        ):
+            return False
+        stat = track_stat(os.path.join(self.root, relpath))
+        if stat is None:
+            return False
+        if entry["size"] == stat[0] and entry["mtime_ns"] == stat[1]:
+            return True
+        if entry["hash"] != file_hash(os.path.join(self.root, relpath)):
+            return False
+        # same content, e.g. the file has been downloaded again or archived
+        entry["size"], entry["mtime_ns"] = stat
+        return True
+
+    def rename(self, flight_id, relpath):
+        """
+        records that the igc file of a flight has been moved, e.g. into an
+        archive, its analysis staying valid as long as its content is the same
+        """
+        entry = self.get(flight_id)
+        if entry is not None:
+            entry["path"] = relpath
+
+    def update(self, flight_id, relpath, params, signature, offset, length):
+        """
+        records the analysis of a flight along with where its glide angles
+        have been written in the glide store
+        """
+        self.entries[str(flight_id)] = {
+            "path": relpath,
+            "version": ANALYSIS_VERSION,
+            "params": params,
+            **signature,
+            "offset": offset,
+            "length": length,
+        }
@@ -0,0 +1,303 @@
+"""
+Runs the whole chain in one command: the flights are analysed as soon as
+they are downloaded, while the next ones are still being fetched, then
+the statistics are aggregated and rendered
+
+The downloads and the analysis are connected by a bounded queue: when the
+analysis lags behind, the downloads wait for it instead of piling up.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+import time
+
+from . import geodesy, utils
+from .cfd_fetcher import (
+    CFDClient,
+    ScrapeJournal,
+    crawl_flight_ids,
+    fetch_flight_data,
+    load_known_ids,
+    save_flight_ids,
+)
+from .flight_index import STATUS_DONE, STATUS_REJECTED, open_flight_index
+from .glide import step2, step3
+from .glide.step1 import StoreSink, process_flight, record_analysis
+from .glide_store import GlideStore
+from .igc_analyser import TrackAnalyser
+from .manifest import AnalysisManifest
+from .shared_arrays import start_sharing
+from .timings import Timings
+
+
+class FlightAnalyser:
+    """
+    analyses the flights put in its queue with a pool of processes,
+    adding their results to a StoreSink and to the flight index
+    """
+
+    def __init__(self, workdir, njobs, params, use_cache=False):
+        self.igc_indir = os.path.join(workdir, "igcfiles")
+        self.njobs = os.cpu_count() if njobs is None else njobs
+        self.params = params
+        self.use_cache = use_cache
+        self.queue = asyncio.Queue(maxsize=2 * self.njobs)
+        self.manifest = AnalysisManifest(
+            utils.get_manifest_file(workdir), self.igc_indir
+        )
+        self.manifest.load()
+        self.index = open_flight_index(workdir)
+        self.sink = StoreSink(
+            GlideStore(utils.get_glide_store_dir(workdir)), self.manifest, params
+        )
+        self.timings = Timings()
+        self.errors = []
+        self.nb_queued = 0
+        self.nb_done = 0
+        self.last_print = 0
+
+    async def put(self, flight_id, data):
+        """
+        queues a flight, waiting while the queue is full
+        """
+        if data is None or "gps" not in data or "wing" not in data:
+            return
+        self.index.add_flight(flight_id, data)
+        status = self.index.get(flight_id)["status"]
+        if status in (STATUS_DONE, STATUS_REJECTED) and self.manifest.is_up_to_date(
+            flight_id, data["gps"], self.params
+        ):
+            return
+        self.nb_queued += 1
+        await self.queue.put(
+            (
+                int(flight_id),
+                int(data["wing"]),
+                data["gps"],
+                os.path.join(self.igc_indir, data["gps"]),
+            )
+        )
+
+    async def worker(self, executor):
+        loop = asyncio.get_running_loop()
+        func = functools.partial(
+            process_flight, use_cache=self.use_cache, params=self.params
+        )
+        while True:
+            job = await self.queue.get()
+            if job is None:
+                return
+            job, signature, result, error, flight_timings = await loop.run_in_executor(
+                executor, func, job
+            )
+            self.timings.merge(flight_timings)
+            if error is not None:
+                print(f"{job[2]} could not be analysed")
+                self.errors.append(
+                    {"flight_id": job[0], "relpath": job[2], "traceback": error}
+                )
+            else:
+                with self.timings.measure("store"):
+                    self.sink.add(job, signature, result)
+            record_analysis(self.index, job, result, error)
+            self.nb_done += 1
+            if time.time() - self.last_print > 1:
+                self.last_print = time.time()
+                self.index.commit()
+                print(
+                    f"{self.nb_done}/{self.nb_queued} flights analysed - "
+                    f"{len(self.errors)} errors - {self.queue.qsize()} waiting"
+                )
+
+    async def run(self, producer):
+        """
+        analyses the flights queued until producer returns
+        """
+        start_sharing()
+        with concurrent.futures.ProcessPoolExecutor(self.njobs) as executor:
+            with self.sink:
+                workers = [
+                    asyncio.ensure_future(self.worker(executor))
+                    for _ in range(self.njobs)
+                ]
+
+                async def feed():
+                    await producer
+                    for _ in workers:
+                        await self.queue.put(None)
+
+                tasks = [asyncio.ensure_future(feed())] + workers
+                try:
+                    # a failing worker must not leave the producer blocked
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    self.manifest.save()
+                    self.index.close()
+
+
+async def scrape_and_analyse(
+    client, workdir, analyser, max_page, known_ids, archive=False
+):
+    ids_file = utils.get_flight_ids_file(workdir)
+    if os.path.isfile(ids_file):
+        with open(ids_file, "r") as f:
+            ids = json.load(f)
+    else:
+        print("Getting all flight ids")
+        ids = await crawl_flight_ids(client, max_page, known_ids)
+        save_flight_ids(workdir, ids, known_ids)
+
+    journal = ScrapeJournal(utils.get_flight_journal_file(workdir))
+    journal.load()
+    print(f"Getting {len(ids)} flights")
+
+    async def producer():
+        try:
+            # the flights downloaded by a previous run are analysed first
+            for flight_id, data in journal.flight_data().items():
+                await analyser.put(flight_id, data)
+            await fetch_flight_data(
+                client,
+                workdir,
+                ids,
+                1000,
+                journal,
+                on_flight=analyser.put,
+                archive=archive,
+            )
+        finally:
+            journal.close()
+
+    await analyser.run(producer())
+    return journal.failed_ids()
+
+
+def main(
+    workdir,
+    njobs=None,
+    params=None,
+    use_cache=False,
+    client=None,
+    max_page=0,
+    known_ids=(),
+    render=True,
+    archive=False,
+):
+    os.makedirs(workdir, exist_ok=True)
+    own_client = client is None
+    if own_client:
+        client = CFDClient()
+    analyser = FlightAnalyser(
+        workdir, njobs, TrackAnalyser.resolve_params(**(params or {})), use_cache
+    )
+    try:
+        failed = asyncio.run(
+            scrape_and_analyse(client, workdir, analyser, max_page, known_ids, archive)
+        )
+    finally:
+        if own_client:
+            client.close()
+        analyser.timings.merge(client.timings)
+        analyser.timings.print_summary()
+        analyser.timings.save(utils.get_timings_file(workdir, "pipeline"))
+        with open(utils.get_errors_file(workdir, "pipeline"), "w") as f:
+            json.dump(analyser.errors, f, indent=2)
+    if len(failed) > 0:
+        print(f"{len(failed)} flights could not be downloaded, run again to retry")
+    if len(analyser.errors) > 0:
+        print(f"{len(analyser.errors)} flights could not be analysed")
+
+    print("Aggregating")
+    step2.main(workdir)
+    if render:
+        print("Rendering")
+        step3.main(utils.get_stat_file(workdir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workdir", type=str, help="Work directory, resumed if any")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Parallel analysis jobs number. Default: Number of cores",
+    )
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default="https://54.36.26.32",
+        help="The server to fetch the flights from (e.g. a local mirror).",
+    )
+    parser.add_argument(
+        "-c",
+        "--connections",
+        type=int,
+        default=15,
+        help="The maximum number of concurrent connections.",
+    )
+    parser.add_argument(
+        "--max-page",
+        type=int,
+        default=0,
+        help="The last listing page to crawl, -1 to crawl them all.",
+    )
+    parser.add_argument(
+        "--known-ids",
+        type=str,
+        default=None,
+        help="Work directory (or json list of flight ids) of a previous scrape, "
+        "the crawl stops at the flights it knew.",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Keep a binary cache of the decoded tracks next to the igc files, "
+        "faster to load than the long tracks it duplicates",
+    )
+    parser.add_argument(
+        "--no-render",
+        action="store_true",
+        help="Stop after the aggregation, without drawing the graph",
+    )
+    parser.add_argument(
+        "--geodesy",
+        choices=geodesy.MODES,
+        default=geodesy.HAVERSINE,
+        help="Computation of the distances and headings, see geodesy.py",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Store the tracks in one compressed archive per batch "
+        "(smaller, but slower to read from a local disk)",
+    )
+    args = parser.parse_args()
+
+    known_ids = []
+    if args.known_ids is not None:
+        known_ids = load_known_ids(args.known_ids)
+    client = CFDClient(
+        args.base_url,
+        max_connections=args.connections,
+        max_per_host=args.connections,
+    )
+    main(
+        os.path.abspath(args.workdir),
+        args.jobs,
+        params={"geodesy_mode": args.geodesy},
+        use_cache=args.cache,
+        client=client,
+        max_page=args.max_page,
+        known_ids=known_ids,
+        render=not args.no_render,
+        archive=args.archive,
+    )
+    client.close()
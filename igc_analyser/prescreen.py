@@ -0,0 +1,93 @@
+"""
+Cheap sanity pre-screen of the igc files, before their full parsing
+
+The mean sampling of a track only depends on its first and last B records
+and on their number, which are found by a scan of the line starts without
+decoding the file: the tracks failing the sampling check (sanity code 1) are
+rejected exactly as TrackAnalyser would. A strided sample of B records
+then catches most of the tracks going back in time (code 2). The
+prescreen never rejects a track the full check would accept, the tracks
+it can't conclude on being left to it.
+"""
+
+import collections
+
+import numpy as np
+
+from .igc_analyser import MAX_TIME_DELTA, MIN_TIME_DELTA
+from .igc_archive import open_track
+from .igc_reader import B_FIELDS, B_RECORD_LEN, IGCReader
+
+PrescreenResult = collections.namedtuple(
+    "PrescreenResult", ["sanity", "time_delta", "day", "nb_fixes"]
+)
+
+
+class IGCPrescreen(IGCReader):
+    """
+    reads the header and a sample of the B records of an igc file
+    """
+
+    def __init__(self, filename, nb_samples=256, raw=None):
+        """
+        raw is the content of the file if already read, see map_track
+        """
+        self.filename = filename
+        self.nb_samples = nb_samples
+        self.raw = raw
+
+    def screen(self):
+        """
+        returns the PrescreenResult of a track known to be rejected,
+        None if it has to be fully checked
+        """
+        raw = self.raw
+        if raw is None:
+            with open_track(self.filename) as f:
+                raw = f.read()
+        raw = np.frombuffer(raw, dtype=np.uint8)
+        line_starts = np.flatnonzero(raw == ord("\n")) + 1
+        line_starts = line_starts[line_starts < raw.shape[0]]
+        if raw.shape[0] > 0:
+            line_starts = np.concatenate(([0], line_starts))
+        b_starts = line_starts[raw[line_starts] == ord("B")]
+        nb_fixes = b_starts.shape[0]
+        if nb_fixes < 2:
+            return None
+
+        for line in raw[: b_starts[0]].tobytes().split(b"\n"):
+            if line.startswith(b"H"):
+                self.read_h_record(line.decode(errors="replace"))
+        if not hasattr(self, "day"):
+            return None
+
+        # evenly spread records, the first and last ones included
+        sample = np.unique(np.linspace(0, nb_fixes - 1, self.nb_samples).astype(int))
+        starts = b_starts[sample]
+        if starts[-1] + B_RECORD_LEN > raw.shape[0]:
+            return None
+        rec = raw[starts[:, None] + np.arange(B_RECORD_LEN)]
+        if np.any(rec == ord("\n")):
+            return None
+        try:
+            hour, minute, second = (
+                self._decode_b_field(rec, *B_FIELDS[name])
+                for name in ("hour", "minute", "second")
+            )
+        except OSError:
+            return None
+        time = hour * 3600 + minute * 60 + second
+
+        # same value as IGCReader.mean_time_delta, the diffs summing exactly
+        time_delta = (time[-1] - time[0]) / (nb_fixes - 1)
+        if time_delta > MAX_TIME_DELTA or time_delta < MIN_TIME_DELTA:
+            sanity = 1
+        elif np.any(np.diff(time) < 0):
+            sanity = 2
+        else:
+            return None
+        return PrescreenResult(sanity, time_delta, self.day, nb_fixes)
+
+
+def prescreen_track(path, nb_samples=256, raw=None):
+    return IGCPrescreen(path, nb_samples, raw).screen()
@@ -0,0 +1,63 @@
+"""
+Transfer of numpy arrays from worker processes through shared memory,
+only a small reference to the array going through the pool pipe
+
+Creating, attaching and releasing a block costs more than pickling a small
+array: bench.py measures the break-even at about 200 KB, below which the
+arrays go through the pipe as they are.
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# size from which an array is sent through shared memory
+SHARE_MIN_BYTES = 1 << 18
+
+
+def start_sharing():
+    """
+    to be called before starting the worker processes: they then share the
+    resource tracker of the parent process, which releases the blocks left
+    over by an interruption, whatever the process that created them
+    """
+    resource_tracker.ensure_running()
+
+
+def share_array(array, min_bytes=SHARE_MIN_BYTES):
+    """
+    copies the array into a new shared memory block and returns its reference,
+    the arrays smaller than min_bytes being returned as they are
+    the block lives until it is taken back by take_shared_array
+    """
+    array = np.ascontiguousarray(array)
+    if array.nbytes < min_bytes:
+        return array
+    # shared memory blocks can't be empty
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    shared = np.ndarray(array.shape, array.dtype, buffer=shm.buf)
+    shared[...] = array
+    del shared
+    shm.close()
+    return shm.name, array.dtype.str, array.shape
+
+
+def take_shared_array(ref):
+    """
+    returns the array of a reference returned by share_array and releases
+    its shared memory block, if any
+    the array is copied out of the block, as the block can't be released
+    while a view on it is alive
+    """
+    if isinstance(ref, np.ndarray):
+        return ref
+    name, dtype, shape = ref
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        shared = np.ndarray(shape, dtype, buffer=shm.buf)
+        array = shared.copy()
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+    return array
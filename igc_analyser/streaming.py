@@ -0,0 +1,207 @@
+"""
+Streaming glide detection, for very long tracks or tracks still being uploaded
+
+The fixes are consumed by chunks, only the fixes of the last frame_len_sec
+seconds being kept between two chunks, and the glide segments are emitted
+as soon as they close.
+"""
+
+import collections
+
+import numpy as np
+
+from . import geodesy
+from .igc_analyser import compute_features, glide_mask, mask_runs
+from .igc_reader import IGCChunkReader
+
+
+class GlideSegment(
+    collections.namedtuple(
+        "GlideSegment",
+        [
+            "start",
+            "end",
+            "nb_samples",
+            "glide_angle_sum",
+            "glide_angle_sum_sq",
+            "distance",
+        ],
+    )
+):
+    """
+    start and end are the timestamps of the first and last fixes of the
+    segment, the sums are over the sweeping mean glide angles of its steps
+    """
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    @property
+    def glide_angle_mean(self):
+        return self.glide_angle_sum / self.nb_samples
+
+
+class StreamingTrackAnalyser:
+    """
+    same detection as TrackAnalyser.process and TrackAnalyser.calc_glide_mask
+    time_delta is the sampling used to turn min_sec into a number of
+    steps, estimated on the first chunk if not given (TrackAnalyser uses the
+    mean sampling of the whole track)
+    the equirectangular projection of geodesy_mode is taken at ref_lat, or
+    at the mean latitude of the first chunk if None
+    """
+
+    def __init__(
+        self,
+        frame_len_sec=20,
+        max_turn=10,
+        min_speed=25,
+        min_sec=20,
+        max_glide_ratio=15,
+        min_glide_ratio=2,
+        time_delta=None,
+        use_baro=True,
+        geodesy_mode=geodesy.HAVERSINE,
+        ref_lat=None,
+    ):
+        self.frame_len_sec = frame_len_sec
+        self.max_turn = max_turn
+        self.min_speed = min_speed
+        self.min_sec = min_sec
+        self.max_glide_ratio = max_glide_ratio
+        self.min_glide_ratio = min_glide_ratio
+        self.time_delta = None
+        if time_delta is not None:
+            self._set_time_delta(time_delta)
+        self.altitude_column = 4 if use_baro else 3
+        self.geodesy_mode = geodesy_mode
+        self.ref_lat = ref_lat
+        self._buffer = np.zeros((0, 5))
+        # heading of the step ending at the first fix of the buffer
+        self._heading = 0
+        self._run = None
+
+    def _set_time_delta(self, time_delta):
+        self.time_delta = time_delta
+        self.min_iter = round(self.min_sec / time_delta)
+
+    def feed(self, data):
+        """
+        consumes a chunk of fixes, as decoded in IGCReader.data_formated,
+        and returns the glide segments closed by this chunk
+        """
+        fixes = np.concatenate((self._buffer, data))
+        if fixes.shape[0] < 2:
+            self._buffer = fixes
+            return []
+        if self.time_delta is None:
+            self._set_time_delta(np.mean(np.diff(fixes[:, 0])))
+        if self.ref_lat is None:
+            self.ref_lat = np.mean(fixes[:, 1])
+
+        features = compute_features(
+            fixes[:, 0],
+            fixes[:, 1],
+            fixes[:, 2],
+            fixes[:, self.altitude_column],
+            self.frame_len_sec,
+            initial_heading=self._heading,
+            geodesy_mode=self.geodesy_mode,
+            ref_lat=self.ref_lat,
+        )
+        # the steps ending at a fix of the buffer have already been consumed
+        first_step = max(0, self._buffer.shape[0] - 1)
+        mask = glide_mask(
+            features["turn_speed"][first_step:],
+            features["straight_line_speed"][first_step:],
+            features["glide_angle_m"][first_step:],
+            self.max_turn,
+            self.min_speed,
+            self.max_glide_ratio,
+            self.min_glide_ratio,
+        )
+        segments = self._update_runs(
+            mask,
+            fixes[first_step:, 0],
+            features["glide_angle_m"][first_step:],
+            features["hor_dist"][first_step:],
+        )
+
+        # the windows of the next steps start at most frame_len_sec before
+        # the last fix
+        keep_from = max(
+            0,
+            np.searchsorted(fixes[:, 0], fixes[-1, 0] - self.frame_len_sec) - 1,
+        )
+        if keep_from > 0:
+            self._heading = features["heading"][keep_from - 1]
+        self._buffer = fixes[keep_from:]
+        return segments
+
+    def _update_runs(self, mask, timestamps, glide_angles, distances):
+        """
+        extends or closes the current run of glide steps with a chunk of steps
+        step i of the chunk goes from the fix at timestamps[i] to the next one
+        returns the runs closed, longer than min_sec
+        """
+        starts, ends = mask_runs(mask)
+        cum = np.concatenate(([0], np.cumsum(glide_angles)))
+        cum_sq = np.concatenate(([0], np.cumsum(glide_angles**2)))
+        cum_dist = np.concatenate(([0], np.cumsum(distances)))
+
+        closed = []
+        if self._run is not None and (mask.shape[0] == 0 or mask[0] == 0):
+            closed.append(self._run)
+            self._run = None
+        for start, end in zip(starts, ends):
+            run = GlideSegment(
+                timestamps[start],
+                timestamps[end],
+                end - start,
+                cum[end] - cum[start],
+                cum_sq[end] - cum_sq[start],
+                cum_dist[end] - cum_dist[start],
+            )
+            if start == 0 and self._run is not None:
+                run = GlideSegment(
+                    self._run.start,
+                    run.end,
+                    *(a + b for a, b in zip(self._run[2:], run[2:])),
+                )
+                self._run = None
+            if end == mask.shape[0]:
+                # may go on in the next chunk
+                self._run = run
+            else:
+                closed.append(run)
+        return [run for run in closed if run.nb_samples > self.min_iter]
+
+    def finish(self):
+        """
+        returns the last glide segment if the track ended during a glide
+        """
+        run = self._run
+        self._run = None
+        if run is not None and run.nb_samples > self.min_iter:
+            return [run]
+        return []
+
+
+def stream_glide_segments(
+    filename,
+    chunk_size=1 << 20,
+    follow=False,
+    poll_interval=1,
+    idle_timeout=60,
+    **kwargs,
+):
+    """
+    yields the glide segments of an igc file, reading it by chunks
+    if follow, the file is tailed until it stops growing, see IGCChunkReader
+    """
+    analyser = StreamingTrackAnalyser(**kwargs)
+    reader = IGCChunkReader(filename, chunk_size, follow, poll_interval, idle_timeout)
+    for data in reader:
+        yield from analyser.feed(data)
+    yield from analyser.finish()
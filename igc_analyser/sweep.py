@@ -0,0 +1,93 @@
+"""
+Evaluates a grid of TrackAnalyser tuning parameters in one pass over a track
+
+The per step features only depend on frame_len_sec and geodesy_mode: they
+are computed once per distinct pair of them, then the glide masks of all
+the grid points sharing it are evaluated together as one 2D array.
+"""
+
+import itertools
+
+import numpy as np
+
+from .igc_analyser import TrackAnalyser, mask_runs
+from .utils import gr2ga
+
+
+def make_grid(**values):
+    """
+    returns the cartesian product of the given parameter values,
+    e.g. make_grid(max_turn=[8, 10], min_speed=[20, 25]), as a list of
+    complete TrackAnalyser parameters (the other ones taking their default)
+    """
+    names = list(values)
+    return [
+        TrackAnalyser.resolve_params(**dict(zip(names, combination)))
+        for combination in itertools.product(*(values[name] for name in names))
+    ]
+
+
+def sweep_track(t, grid):
+    """
+    returns the number of glide samples and the sums and sums of squares of
+    their glide angles for every grid point, on a processed TrackAnalyser
+    the frame_len_sec and geodesy_mode of the grid points are assumed to be
+    the ones of t
+    """
+
+    def column(values):
+        return np.array(values, dtype=float)[:, None]
+
+    nb_points = len(grid)
+    nb_steps = t.glide_angles.shape[0]
+    mask = (
+        (np.abs(t.turn_speeds) < column([p["max_turn"] for p in grid]))
+        & (t.straight_line_speeds > column([p["min_speed"] / 3.6 for p in grid]))
+        & (t.glide_angles < column([gr2ga(p["max_glide_ratio"]) for p in grid]))
+        & (t.glide_angles > column([gr2ga(p["min_glide_ratio"]) for p in grid]))
+    )
+    min_iter = np.array([round(p["min_sec"] / t.track_mean_time_delta) for p in grid])
+
+    # the rows are separated by a 0 so that runs never span two grid points
+    padded = np.zeros((nb_points, nb_steps + 1), dtype=int)
+    padded[:, :nb_steps] = mask
+    starts, ends = mask_runs(padded.ravel())
+    row = starts // (nb_steps + 1)
+    starts -= row * (nb_steps + 1)
+    ends -= row * (nb_steps + 1)
+    keep = ends - starts > min_iter[row]
+    row, starts, ends = row[keep], starts[keep], ends[keep]
+
+    cum = np.concatenate(([0], np.cumsum(t.glide_angles)))
+    cum_sq = np.concatenate(([0], np.cumsum(t.glide_angles**2)))
+    return (
+        np.bincount(row, ends - starts, nb_points).astype(np.int64),
+        np.bincount(row, cum[ends] - cum[starts], nb_points),
+        np.bincount(row, cum_sq[ends] - cum_sq[starts], nb_points),
+    )
+
+
+def sweep_file(path, grid, use_cache=False):
+    """
+    returns the per grid point sums of sweep_track, the sampling and the day
+    of an igc file, or None if the track is not sane
+    """
+    t = TrackAnalyser(path, use_cache=use_cache)
+    use_baro, sanity = t.select_altitude_source()
+    if sanity != 0:
+        return None
+    nb_sample = np.zeros(len(grid), dtype=np.int64)
+    sums = np.zeros(len(grid))
+    sums_sq = np.zeros(len(grid))
+    features = [(p["frame_len_sec"], p["geodesy_mode"]) for p in grid]
+    for frame_len_sec, geodesy_mode in sorted(set(features)):
+        points = [
+            i for i, f in enumerate(features) if f == (frame_len_sec, geodesy_mode)
+        ]
+        t.frame_len_sec = frame_len_sec
+        t.geodesy_mode = geodesy_mode
+        t.process(use_baro=use_baro)
+        nb_sample[points], sums[points], sums_sq[points] = sweep_track(
+            t, [grid[i] for i in points]
+        )
+    return nb_sample, sums, sums_sq, t.track_mean_time_delta, t.track.day.toordinal()
@@ -0,0 +1,140 @@
+"""
+Generation of synthetic igc files, alternating thermals and glides,
+to benchmark and check the analysis pipeline without any download
+"""
+
+import datetime as dt
+import os
+
+import numpy as np
+
+from . import utils
+from .flight_index import FlightIndex
+
+# mean radius of the earth used to move the fixes, in meters
+EARTH_RADIUS = 6371008.8
+
+
+def generate_fixes(
+    duration=3600,
+    sampling=1,
+    glide_sec=300,
+    thermal_sec=300,
+    speed=36,
+    glide_ratio=8,
+    climb_rate=1.5,
+    turn_rate=20,
+    noise=0.5,
+    start=(45.5, 6.2, 2000),
+    start_time=10 * 3600,
+    seed=0,
+):
+    """
+    returns the fixes of a flight as decoded in IGCReader.data_formated
+    the flight alternates thermals, climbing at climb_rate m/s while turning
+    at turn_rate deg/s, and glides at glide_ratio, both lasting about
+    thermal_sec and glide_sec (+/- 50%)
+    speed is the airspeed in km/h, noise the standard deviation in meters
+    of the gnss and baro altitude errors
+    """
+    rng = np.random.default_rng(seed)
+    nb_fixes = int(duration / sampling) + 1
+    ts = start_time + np.arange(nb_fixes) * sampling
+
+    # phase of every fix, the flight starting with a glide
+    phase_lens = []
+    nb_phased = 0
+    while nb_fixes > nb_phased:
+        mean_sec = thermal_sec if len(phase_lens) % 2 else glide_sec
+        phase_lens.append(max(1, round(mean_sec * rng.uniform(0.5, 1.5) / sampling)))
+        nb_phased += phase_lens[-1]
+    thermal = (np.repeat(np.arange(len(phase_lens)), phase_lens) % 2 == 1)[:nb_fixes]
+
+    # heading in degrees: constant turn in thermal, slow drift in glide
+    glide_heading = np.cumsum(rng.normal(0, 2, nb_fixes))
+    turn = np.where(thermal, turn_rate * sampling, 0)
+    heading = np.cumsum(turn) + glide_heading + rng.uniform(0, 360)
+
+    step = speed / 3.6 * sampling
+    vertical = np.where(thermal, climb_rate * sampling, -step / glide_ratio)
+    north = step * np.cos(np.radians(heading))
+    east = step * np.sin(np.radians(heading))
+    lat = start[0] + np.degrees(np.cumsum(north) / EARTH_RADIUS)
+    lon = start[1] + np.degrees(
+        np.cumsum(east / np.cos(np.radians(lat))) / EARTH_RADIUS
+    )
+    altitude = start[2] + np.cumsum(vertical)
+    altitude_gnss = altitude + rng.normal(0, noise, nb_fixes)
+    altitude_baro = altitude + rng.normal(0, noise, nb_fixes)
+
+    return np.column_stack((ts, lat, lon, altitude_gnss, altitude_baro))
+
+
+def format_igc(fixes, day=dt.date(2023, 7, 15)):
+    """
+    returns the content of an igc file holding the given fixes
+    the coordinates are rounded to the igc resolution (1/1000 minute, 1 m)
+    """
+    lines = ["AXXXSYNTHETIC\r\n", f"HFDTE{day.strftime('%d%m%y')}\r\n"]
+    for ts, lat, lon, alt_gnss, alt_baro in fixes:
+        secs = int(ts) % 86400
+        lat_min = round(abs(lat) * 60000)
+        lon_min = round(abs(lon) * 60000)
+        lines.append(
+            "B%02d%02d%02d%02d%05d%s%03d%05d%sA%05d%05d\r\n"
+            % (
+                secs // 3600,
+                secs % 3600 // 60,
+                secs % 60,
+                lat_min // 60000,
+                lat_min % 60000,
+                "N" if lat >= 0 else "S",
+                lon_min // 60000,
+                lon_min % 60000,
+                "E" if lon >= 0 else "W",
+                max(0, round(alt_gnss)),
+                max(0, round(alt_baro)),
+            )
+        )
+    return "".join(lines)
+
+
+def write_igc(path, day=dt.date(2023, 7, 15), **kwargs):
+    """
+    writes a synthetic flight, kwargs being the ones of generate_fixes
+    """
+    with open(path, "w", newline="") as f:
+        f.write(format_igc(generate_fixes(**kwargs), day))
+
+
+def make_workdir(
+    workdir,
+    nb_flights,
+    nb_wings=3,
+    min_duration=1800,
+    max_duration=7200,
+    sampling=1,
+    seed=0,
+):
+    """
+    fills a work directory as cfd_fetcher would, with nb_flights synthetic
+    flights of nb_wings wings whose glide ratio ranges from 6 to 10
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(utils.get_track_save_dir(workdir, 0), exist_ok=True)
+    glide_ratios = np.linspace(6, 10, nb_wings)
+    flights = {}
+    for i in range(nb_flights):
+        wing_id = i % nb_wings
+        relpath = os.path.join("0", f"{i}.igc")
+        write_igc(
+            os.path.join(workdir, "igcfiles", relpath),
+            day=dt.date(2023, 1, 1) + dt.timedelta(days=int(rng.integers(365))),
+            duration=int(rng.integers(min_duration, max_duration + 1)),
+            sampling=sampling,
+            glide_ratio=glide_ratios[wing_id] * rng.uniform(0.95, 1.05),
+            seed=seed * nb_flights + i,
+        )
+        flights[str(i)] = {"gps": relpath, "wing": str(wing_id)}
+    with FlightIndex(utils.get_flight_index_file(workdir)) as index:
+        index.add_flights(flights.items())
@@ -0,0 +1,97 @@
+"""
+Per stage timings and event counters of a run, summarized in a json file
+"""
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# log spaced histogram bins, from 1 us to 1000 s
+HISTOGRAM_EDGES = 10 ** np.arange(-6, 3.25, 0.25)
+
+
+class Timings:
+    """
+    durations of the stages of a run, e.g. the parsing of every flight,
+    and counters of events, e.g. the rejected flights
+    safe to use from several threads, and picklable to be sent back by
+    worker processes and merged
+    """
+
+    def __init__(self):
+        self.durations = collections.defaultdict(list)
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"durations": dict(self.durations), "counters": self.counters}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.durations.update(state["durations"])
+        self.counters.update(state["counters"])
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, duration):
+        with self._lock:
+            self.durations[stage].append(duration)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def merge(self, other):
+        with self._lock:
+            for stage, durations in other.durations.items():
+                self.durations[stage].extend(durations)
+            self.counters.update(other.counters)
+
+    def summary(self):
+        stages = {}
+        for stage, durations in self.durations.items():
+            durations = np.array(durations)
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+            stages[stage] = {
+                "count": len(durations),
+                "total": float(np.sum(durations)),
+                "mean": float(np.mean(durations)),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(np.max(durations)),
+                "histogram": np.histogram(durations, HISTOGRAM_EDGES)[0].tolist(),
+            }
+        return {
+            "stages": stages,
+            "counters": dict(self.counters),
+            "histogram_edges": HISTOGRAM_EDGES.tolist(),
+        }
+
+    def save(self, path):
+        tmpfile = f"{path}.tmp"
+        with open(tmpfile, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(tmpfile, path)
+
+    def print_summary(self):
+        summary = self.summary()
+        for stage, s in summary["stages"].items():
+            print(
+                f"{stage:<28} {s['count']:>8} x  total {s['total']:>9.2f}s  "
+                f"p50 {s['p50']*1000:>9.2f}ms  p95 {s['p95']*1000:>9.2f}ms  "
+                f"p99 {s['p99']*1000:>9.2f}ms"
+            )
+        for name, count in sorted(summary["counters"].items()):
+            print(f"{name:<28} {count:>8}")
@@ -27,11 +27,53 @@ def get_flight_json_file(workdir):
     return os.path.join(workdir, "flight_data.json")
 
 
+def get_flight_index_file(workdir):
+    return os.path.join(workdir, "flight_index.sqlite")
+
+
+def get_flight_journal_file(workdir):
+    return os.path.join(workdir, "flight_journal.jsonl")
+
+
+def get_flight_ids_file(workdir):
+    return os.path.join(workdir, "flight_ids.json")
+
+
+def get_known_ids_file(workdir):
+    return os.path.join(workdir, "known_flight_ids.json")
+
+
 def get_stat_file(workdir):
     return os.path.join(workdir, "flight_stat.dat")
 
 
-def get_json_file_path_from_igc(workdir, igcfile):
-    flight_data_file = igcfile.replace(".igc", ".json")
-    flight_data_path = os.path.join(workdir, "igcfiles", flight_data_file)
-    return flight_data_path
+def get_sweep_stat_file(workdir):
+    return os.path.join(workdir, "sweep_stat.dat")
+
+
+def get_timings_file(workdir, step):
+    return os.path.join(workdir, f"{step}_timings.json")
+
+
+def get_errors_file(workdir, step):
+    return os.path.join(workdir, f"{step}_errors.json")
+
+
+def get_accumulator_file(workdir):
+    return os.path.join(workdir, "wing_accumulators.npz")
+
+
+def get_manifest_file(workdir):
+    return os.path.join(workdir, "analysis_manifest.json")
+
+
+def get_glide_store_dir(workdir):
+    return os.path.join(workdir, "glide_store")
+
+
+def get_track_cache_path(igcfile):
+    return os.path.splitext(igcfile)[0] + ".track.npz"
+
+
+def get_track_archive_file(workdir, batch_no):
+    return os.path.join(workdir, "igcfiles", f"{batch_no}.igcz")
@@ -0,0 +1,113 @@
+"""
+Rolling statistics over time windows of a signal, from its prefix sums
+
+The windows are found by a binary search of the timestamps, so that they
+span the same duration whatever the sampling (gaps, irregular loggers),
+and their sums are differences of two prefix sums: the sum, mean and
+variance of all the windows of a signal cost O(n) whatever their length.
+
+A signal may hold several tracks one after the other (segments), given by
+their offsets: the windows and the prefix sums then restart at every
+segment.
+"""
+
+import numpy as np
+
+
+def prefix_sums(values, offsets=None):
+    """
+    returns the cumulative sums of the values, each segment
+    offsets[k] .. offsets[k + 1] - 1 restarting from a 0 of its own: the sum
+    of the first j values of segment k is at offsets[k] + k + j
+    the sums of a segment are differences of the sums of the whole signal,
+    so they round slightly differently than if it was on its own
+    """
+    sums = np.concatenate(([0], np.cumsum(values)))
+    if offsets is None:
+        return sums
+    offsets = np.asarray(offsets)
+    nb_segments = len(offsets) - 1
+    position = np.arange(values.shape[0] + nb_segments)
+    # segment k holds its 0 and its values
+    segment = np.repeat(np.arange(nb_segments), np.diff(offsets) + 1)
+    return sums[position - segment] - sums[offsets[segment]]
+
+
+def segment_of(index, offsets):
+    """
+    returns the segment of every index of a segmented signal
+    """
+    return np.searchsorted(offsets, index, side="right") - 1
+
+
+class Windows:
+    """
+    window k covers the values lo[k] .. hi[k] - 1 of a signal, all of them
+    in the same segment
+    """
+
+    def __init__(self, lo, hi, offsets=None, segment=None):
+        """
+        segment is the segment of every window, found from the offsets if None
+        """
+        self.lo = lo
+        self.hi = hi
+        self.offsets = offsets
+        if offsets is not None and segment is None:
+            segment = segment_of(lo, offsets)
+        # position of lo and hi in the prefix sums
+        self._shift = 0 if offsets is None else segment
+
+    @classmethod
+    def trailing(cls, start_ts, end_ts, duration, offsets=None):
+        """
+        returns the windows ending at every value i, covering the values j
+        of its segment with start_ts[j] >= end_ts[i] - duration, and at least
+        value i itself
+        for the steps of a track, start_ts and end_ts are the timestamps of
+        their first and last fixes, so that the fixes of a window span at
+        most duration seconds
+        start_ts must be increasing within every segment
+        """
+        hi = np.arange(1, start_ts.shape[0] + 1)
+        if offsets is None:
+            lo = np.searchsorted(start_ts, end_ts - duration, side="left")
+            return cls(np.minimum(lo, hi - 1), hi)
+
+        # the segments are shifted apart so that their timestamps are
+        # increasing all along the signal
+        segment = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        starts = np.asarray(offsets[:-1])
+        non_empty = np.diff(offsets) > 0
+        first = np.zeros(len(offsets) - 1)
+        first[non_empty] = start_ts[starts[non_empty]]
+        span = np.max(end_ts - first[segment], initial=0) + abs(duration) + 1
+        shift = segment * span - first[segment]
+        lo = np.searchsorted(start_ts + shift, end_ts - duration + shift, side="left")
+        lo = np.clip(lo, starts[segment], hi - 1)
+        return cls(lo, hi, offsets, segment)
+
+    def count(self):
+        return self.hi - self.lo
+
+    def sum(self, values, sums=None):
+        """
+        sums are the prefix_sums of the values, if already computed
+        """
+        if sums is None:
+            sums = prefix_sums(values, self.offsets)
+        return sums[self.hi + self._shift] - sums[self.lo + self._shift]
+
+    def mean(self, values, sums=None):
+        return self.sum(values, sums) / self.count()
+
+    def var(self, values):
+        """
+        population variance of the windows
+        the values are centered on their overall mean first, to limit the
+        cancellation between the sums of the values and of their squares
+        """
+        centered = values - np.mean(values)
+        count = self.count()
+        mean = self.mean(centered)
+        return np.maximum(self.sum(centered**2) / count - mean**2, 0)
@@ -0,0 +1,222 @@
+"""
+Grouped aggregation of the glide angles of a GlideStore into per-wing statistics
+"""
+
+import os
+
+import numpy as np
+
+from .glide_store import last_records
+
+
+def slice_sums(values, offset, length):
+    """
+    returns the sums and sums of squares of the slices of values,
+    whatever their order or the gaps between them
+    only the span of values covered by the slices is read, and only the
+    slices themselves if they are sparse within this span
+    """
+    if offset.shape[0] == 0:
+        return np.zeros(0), np.zeros(0)
+    lo = np.min(offset)
+    hi = np.max(offset + length)
+    total = np.sum(length)
+    if 2 * total >= hi - lo:
+        # dense slices: differences of prefix sums over the whole span
+        span = np.asarray(values[lo:hi], dtype=np.float64)
+        start = offset - lo
+    else:
+        # sparse slices: gather them first
+        start = np.concatenate(([0], np.cumsum(length)[:-1]))
+        span = np.asarray(
+            values[np.repeat(offset - start, length) + np.arange(total)],
+            dtype=np.float64,
+        )
+    end = start + length
+    cum = np.concatenate(([0], np.cumsum(span)))
+    cum_sq = np.concatenate(([0], np.cumsum(np.square(span))))
+    return cum[end] - cum[start], cum_sq[end] - cum_sq[start]
+
+
+class FlightSums:
+    """
+    per flight sums of the glide angles, computed once from a store so that
+    the per-wing statistics can be evaluated for any selection of flights
+    without reading the glide angles again
+    """
+
+    def __init__(self, index, values):
+        self.flight_id = index["flight_id"]
+        self.wing_id = index["wing_id"]
+        self.date = index["date"]
+        self.sampling = index["sampling"]
+        self.nb_sample = index["length"]
+        self.sum, self.sum_sq = slice_sums(values, index["offset"], index["length"])
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(*store.load())
+
+    @classmethod
+    def from_arrays(cls, flight_id, wing_id, date, sampling, nb_sample, sum, sum_sq):
+        """
+        builds the per flight sums from already computed sums
+        """
+        flights = cls.__new__(cls)
+        flights.flight_id = np.asarray(flight_id)
+        flights.wing_id = np.asarray(wing_id)
+        flights.date = np.asarray(date)
+        flights.sampling = np.asarray(sampling)
+        flights.nb_sample = np.asarray(nb_sample)
+        flights.sum = np.asarray(sum)
+        flights.sum_sq = np.asarray(sum_sq)
+        return flights
+
+    def __len__(self):
+        return self.flight_id.shape[0]
+
+    def select(self, since=None, until=None, wing_ids=None):
+        """
+        returns a boolean mask of the flights matching all the given criterias
+        since and until are datetime.date, bounds included
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if since is not None:
+            mask &= self.date >= since.toordinal()
+        if until is not None:
+            mask &= self.date <= until.toordinal()
+        if wing_ids is not None:
+            mask &= np.isin(self.wing_id, list(wing_ids))
+        return mask
+
+    def by_wing(self, mask=None, min_samples=0):
+        """
+        computes the weighted mean, standard deviation and 95% confidence
+        interval of the glide angle of every wing
+        wings with less than min_samples samples are discarded
+        """
+        return WingAccumulators.from_flight_sums(self, mask).to_wings_perf(min_samples)
+
+
+class WingAccumulators:
+    """
+    per wing sufficient statistics of the glide angles (weighted sums and
+    sums of squares), which can be merged with, or subtracted from, the
+    statistics of other sets of flights
+    nb_records is the number of store index records folded in
+    """
+
+    FIELDS = ("sum_av", "sum_sq", "weight", "nb_sample")
+
+    def __init__(
+        self,
+        wing_id=None,
+        sum_av=None,
+        sum_sq=None,
+        weight=None,
+        nb_sample=None,
+        store_id="",
+        nb_records=0,
+    ):
+        self.wing_id = np.zeros(0, dtype=np.int64) if wing_id is None else wing_id
+        self.sum_av = np.zeros(0) if sum_av is None else sum_av
+        self.sum_sq = np.zeros(0) if sum_sq is None else sum_sq
+        self.weight = np.zeros(0) if weight is None else weight
+        self.nb_sample = np.zeros(0, dtype=np.int64) if nb_sample is None else nb_sample
+        self.store_id = store_id
+        self.nb_records = nb_records
+
+    @classmethod
+    def from_flight_sums(cls, flights, mask=None):
+        if mask is None:
+            mask = np.ones(len(flights), dtype=bool)
+        wing_id, wing_idx = np.unique(flights.wing_id[mask], return_inverse=True)
+        sampling = flights.sampling[mask]
+        nb_wings = wing_id.shape[0]
+        return cls(
+            wing_id,
+            np.bincount(wing_idx, flights.sum[mask] * sampling, nb_wings),
+            np.bincount(wing_idx, flights.sum_sq[mask] * sampling, nb_wings),
+            np.bincount(wing_idx, flights.nb_sample[mask] * sampling, nb_wings),
+            np.bincount(wing_idx, flights.nb_sample[mask], nb_wings).astype(np.int64),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(
+                *(f[name] for name in ("wing_id",) + cls.FIELDS),
+                store_id=str(f["store_id"]),
+                nb_records=int(f["nb_records"]),
+            )
+
+    def save(self, path):
+        tmpfile = f"{path}.tmp"
+        with open(tmpfile, "wb") as f:
+            np.savez(
+                f,
+                wing_id=self.wing_id,
+                store_id=self.store_id,
+                nb_records=self.nb_records,
+                **{name: getattr(self, name) for name in self.FIELDS},
+            )
+        os.replace(tmpfile, path)
+
+    def merge(self, other, sign=1):
+        """
+        returns the accumulators of the union of both sets of flights,
+        or of their difference if sign is -1
+        """
+        wing_id = np.union1d(self.wing_id, other.wing_id)
+        merged = WingAccumulators(wing_id, store_id=self.store_id)
+        merged.nb_records = self.nb_records
+        for name in self.FIELDS:
+            values = np.zeros(wing_id.shape[0], dtype=getattr(self, name).dtype)
+            values[np.searchsorted(wing_id, self.wing_id)] += getattr(self, name)
+            values[np.searchsorted(wing_id, other.wing_id)] += sign * getattr(
+                other, name
+            )
+            setattr(merged, name, values)
+        return merged
+
+    def fold_store(self, store):
+        """
+        returns the accumulators updated with the records appended to the
+        store since the last fold, only reading the glide angles of these
+        records and of the records they supersede
+        the accumulators are rebuilt if the store has been cleared meanwhile
+        """
+        acc = self
+        if self.store_id != store.get_store_id():
+            acc = WingAccumulators(store_id=store.get_store_id())
+        raw_index = store.read_raw_index()
+        values = store.read_values()
+        new = last_records(raw_index[acc.nb_records :])
+        old = last_records(raw_index[: acc.nb_records])
+        superseded = old[np.isin(old["flight_id"], new["flight_id"])]
+        acc = acc.merge(
+            WingAccumulators.from_flight_sums(FlightSums(new, values))
+        ).merge(
+            WingAccumulators.from_flight_sums(FlightSums(superseded, values)),
+            sign=-1,
+        )
+        acc.nb_records = raw_index.shape[0]
+        return acc
+
+    def to_wings_perf(self, min_samples=0):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self.sum_av / self.weight
+            std_deviation = np.sqrt(self.sum_sq / self.weight - mean**2)
+            # https://fr.wikipedia.org/wiki/Intervalle_de_confiance#Estimation_d'une_moyenne
+            confidence_95 = 2 * std_deviation / np.sqrt(self.nb_sample)
+
+        wings_perf = {}
+        # wings whose flights have all been removed are left out
+        for i in np.flatnonzero((self.nb_sample >= min_samples) & (self.nb_sample > 0)):
+            wings_perf[int(self.wing_id[i])] = {
+                "mean": mean[i],
+                "dev_hist": std_deviation[i],
+                "confidence": confidence_95[i],
+                "nb_sample": int(self.nb_sample[i]),
+            }
+        return wings_perf
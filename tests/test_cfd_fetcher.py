@@ -0,0 +1,149 @@
+"""
+Fetches flights from a stub CFD server serving canned pages, some of them
+failing before succeeding
+"""
+
+import collections
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from igc_analyser import cfd_fetcher, utils
+from igc_analyser.flight_index import FlightIndex
+
+IGC = b"AXXX\nHFDTE150723\nB1000004530005N00612003EA0200102004\n"
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.path] += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            # the statuses to answer before the page, e.g. [429, 500]
+            statuses = server.failures.get(self.path, [])
+            status = statuses.pop(0) if len(statuses) > 0 else 200
+        try:
+            # slow enough for the requests to overlap
+            time.sleep(0.01)
+            body = b""
+            if status == 200:
+                body = self.page()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def page(self):
+        if self.path.startswith("/sites/parapente.ffvl.fr/files/igcfiles/"):
+            return IGC
+        flight_id = self.path.split("/")[-1]
+        return (
+            '<html><div id="block-system-main">'
+            f'<a href="/sites/parapente.ffvl.fr/files/igcfiles/f{flight_id}.igc">t</a>'
+            f'<a href="https://parapente.ffvl.fr/cfd/liste/aile/{flight_id}">w</a>'
+            "</div></html>"
+        ).encode()
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.requests = collections.Counter()
+    server.failures = {}
+    server.in_flight = 0
+    server.max_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(cfd_fetcher, "backoff_delay", lambda attempt: 0)
+
+
+def make_client(server):
+    return cfd_fetcher.CFDClient(
+        f"http://127.0.0.1:{server.server_address[1]}",
+        max_connections=4,
+        max_per_host=2,
+    )
+
+
+def test_retries_and_resume(server, tmp_path):
+    outdir = str(tmp_path)
+    ids = list(range(1, 9))
+    server.failures = {
+        "/cfd/liste/vol/1": [429, 500],
+        "/sites/parapente.ffvl.fr/files/igcfiles/f2.igc": [503],
+        # more failures than retries
+        "/cfd/liste/vol/3": [500] * 6,
+    }
+
+    client = make_client(server)
+    try:
+        cfd_fetcher.get_flight_data(outdir, ids, batch_size=4, client=client)
+    finally:
+        client.close()
+    assert client.timings.counters["retry"] == 2 + 1 + 5
+    assert client.timings.counters["http 429"] == 1
+    assert server.requests["/cfd/liste/vol/1"] == 3
+    assert server.requests["/cfd/liste/vol/3"] == 6
+    assert server.max_in_flight <= 2
+
+    journal = cfd_fetcher.ScrapeJournal(utils.get_flight_journal_file(outdir))
+    journal.load()
+    assert journal.failed_ids() == [3]
+    assert sorted(journal.flight_data()) == [id for id in ids if id != 3]
+    assert journal.flight_data()[5] == {"gps": "1/f5.igc", "wing": "5"}
+    with open(os.path.join(outdir, "igcfiles", "0", "f2.igc"), "rb") as f:
+        assert f.read() == IGC
+
+    # the resumed scrape only fetches the failed flight
+    fetched = server.requests.copy()
+    client = make_client(server)
+    try:
+        cfd_fetcher.get_flight_data(outdir, ids, batch_size=4, client=client)
+    finally:
+        client.close()
+    new_requests = server.requests - fetched
+    assert set(new_requests) == {
+        "/cfd/liste/vol/3",
+        "/sites/parapente.ffvl.fr/files/igcfiles/f3.igc",
+    }
+    journal = cfd_fetcher.ScrapeJournal(utils.get_flight_journal_file(outdir))
+    journal.load()
+    assert journal.failed_ids() == []
+    assert sorted(journal.flight_data()) == ids
+    with FlightIndex(utils.get_flight_index_file(outdir)) as index:
+        assert len(index.all()) == len(ids)
+
+
+def test_known_ids_chain(tmp_path):
+    previous = [1, 2, 3]
+    for i, new_ids in enumerate([[5, 4], [], [6]]):
+        workdir = str(tmp_path / str(i))
+        os.makedirs(workdir)
+        cfd_fetcher.save_flight_ids(workdir, new_ids, previous)
+        previous = cfd_fetcher.load_known_ids(workdir)
+    # the run which found nothing new kept the flights known before it
+    assert previous == [1, 2, 3, 4, 5, 6]
+    with open(utils.get_flight_ids_file(workdir)) as f:
+        assert json.load(f) == [6]
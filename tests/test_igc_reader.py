@@ -0,0 +1,44 @@
+"""
+Reads synthetic igc files by chunks, including a live track still being written
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from igc_analyser import synthetic
+from igc_analyser.igc_reader import IGCChunkReader, IGCReader
+
+
+def test_small_chunks(tmp_path):
+    path = str(tmp_path / "flight.igc")
+    synthetic.write_igc(path, duration=600)
+    chunks = list(IGCChunkReader(path, chunk_size=20))
+    np.testing.assert_array_equal(np.concatenate(chunks), IGCReader(path).data_formated)
+
+
+def test_follow_from_header_only(tmp_path):
+    path = str(tmp_path / "live.igc")
+    content = synthetic.format_igc(synthetic.generate_fixes(duration=600))
+    header_len = content.index("\nB") + 1
+    with open(path, "w", newline="") as f:
+        f.write(content[:header_len])
+
+    def write_fixes():
+        time.sleep(0.3)
+        with open(path, "a", newline="") as f:
+            # the last line is written in two steps
+            f.write(content[header_len:-20])
+            f.flush()
+            time.sleep(0.3)
+            f.write(content[-20:])
+
+    writer = threading.Thread(target=write_fixes)
+    writer.start()
+    try:
+        reader = IGCChunkReader(path, follow=True, poll_interval=0.05, idle_timeout=1)
+        chunks = list(reader)
+    finally:
+        writer.join()
+    np.testing.assert_array_equal(np.concatenate(chunks), IGCReader(path).data_formated)